@@ -1,2 +1,9 @@
-from bbparser import parse, ParserError
-
+from bbparser import parse, iterparse, ParserError, LimitExceeded
+from batch import parse_many, parse_files
+from cache import ParseCache, StrictCache
+from delta import parse_delta
+from tracing import Tracer, StatsTracer, set_tracer
+from projection import Projection
+from sanitizer import SanitizePolicy
+from normalize import normalize
+from limits import Limits
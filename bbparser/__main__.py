@@ -0,0 +1,140 @@
+"""Batch converter from feeds to JSON, run with python -m bbparser.
+
+Reads the feed files in the directories and files given as arguments, or
+listed on standard input one per line, each path optionally followed by a tab
+and a JSON object of the HTTP headers the feed was fetched with. Feeds are
+parsed in a pool of worker processes and every entry is written to standard
+output as a line of JSON, with the path and the id, title and link of its
+feed. Failures and a summary are written to standard error.
+"""
+
+import os
+import sys
+import time
+import errno
+import datetime
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from batch import parse_files
+
+
+FEED_KEYS = ('id', 'title', 'link')
+
+
+def _default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+def walk(path):
+    """Yields the files under path, or path itself if it is a file."""
+    if not os.path.isdir(path):
+        yield path
+        return
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            yield os.path.join(root, name)
+
+def read_manifest(lines, errors):
+    """Yields (path, headers) tuples from lines of paths, each optionally
+    followed by a tab and a JSON object of headers. Invalid lines are
+    appended to errors as (line number, message) tuples."""
+    for number, line in enumerate(lines):
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        path, sep, headers = line.partition('\t')
+        if not headers.strip():
+            yield path, None
+            continue
+        try:
+            headers = json.loads(headers)
+            if not isinstance(headers, dict):
+                raise ValueError("headers are not a JSON object")
+        except ValueError, e:
+            errors.append((number + 1, e))
+            continue
+        yield path, dict((k.lower(), v) for k, v in headers.items())
+
+def convert(items, out=sys.stdout, err=sys.stderr, **kw):
+    """Parses the (path, headers) tuples in items with parse_files(), and
+    writes each entry to out as a line of JSON. Returns a dictionary of
+    statistics."""
+    stats = dict(feeds=0, entries=0, failures=0, bytes=0)
+    paths = dict()
+    def tasks():
+        # runs in the thread feeding the pool, the window bounds paths
+        for index, item in enumerate(items):
+            paths[index] = item[0]
+            yield item
+    for index, data, error in parse_files(tasks(), **kw):
+        path = paths.pop(index)
+        try:
+            stats['bytes'] += os.path.getsize(path)
+        except OSError:
+            pass
+        stats['feeds'] += 1
+        if error is not None:
+            stats['failures'] += 1
+            err.write("%s: %s\n" % (path, error))
+            continue
+        feed = dict((k, data.get(k)) for k in FEED_KEYS)
+        for entry in data.get('entries') or ():
+            entry['source'] = path
+            entry['feed'] = feed
+            out.write(json.dumps(entry, default=_default, separators=(',', ':')))
+            out.write('\n')
+            stats['entries'] += 1
+    return stats
+
+def main(argv=None):
+    parser = OptionParser(
+        usage="%prog [options] [path ...]",
+        description="Converts feed files, in the directories or files given or listed on "
+            "standard input, to lines of JSON with one entry each.")
+    parser.add_option('-w', '--workers', type='int', help="number of worker processes, the default is one per CPU")
+    parser.add_option('-c', '--chunksize', type='int', default=8, help="feeds sent to a worker at a time")
+    parser.add_option('-W', '--window', type='int', default=256, help="largest number of feeds in progress")
+    parser.add_option('-u', '--unordered', action='store_true', help="write the entries of each feed as soon as it is parsed, instead of in input order")
+    parser.add_option('-f', '--fields', metavar='NAMES', help="comma separated fields to parse, see Projection")
+    parser.add_option('-n', '--no-compat', action='store_true', help="disable the feedparser compatibility mode")
+    options, args = parser.parse_args(argv)
+    errors = list()
+    if not args or args == ['-']:
+        items = read_manifest(sys.stdin, errors)
+    else:
+        items = ((path, None) for arg in args for path in walk(arg))
+    fields = None
+    if options.fields:
+        fields = [f.strip() for f in options.fields.split(',') if f.strip()]
+    start = time.time()
+    try:
+        stats = convert(
+            items, workers=options.workers, chunksize=options.chunksize,
+            window=options.window, ordered=not options.unordered,
+            feedparser_compat=not options.no_compat, fields=fields)
+    except IOError, e:
+        if e.errno != errno.EPIPE:
+            raise
+        # output closed early, as by head
+        return 1
+    elapsed = time.time() - start
+    for number, error in errors:
+        sys.stderr.write("line %d: %s\n" % (number, error))
+    stats['failures'] += len(errors)
+    sys.stderr.write(
+        "%(feeds)d feeds, %(entries)d entries, %(failures)d failures" % stats +
+        " in %.2fs, %.1f feeds/s, %.2f MB/s\n" % (
+            elapsed, stats['feeds'] / elapsed if elapsed else 0,
+            stats['bytes'] / elapsed / 1048576 if elapsed else 0))
+    return 1 if stats['failures'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
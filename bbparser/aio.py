@@ -0,0 +1,339 @@
+"""Concurrent fetch and parse front end.
+
+FeedPoller fetches feeds through a pluggable transport, sending conditional
+requests with the ETag and Last-Modified validators of the previous fetch of
+each URL, so that feeds answering 304 are not parsed at all. Changed feeds
+are parsed in a bounded pool of worker processes. Fetches run in a pool of
+threads, with a limit on the requests in progress for each host.
+
+>>> transport = LocalTransport({
+...     'http://example.com/rss': ('<rss version="2.0"><channel><title>t</title></channel></rss>', {'ETag': '"1"'}),
+... })
+>>> poller = FeedPoller(transport, processes=0)
+>>> [(r.url, r.status, r.data['title']) for r in poller.poll(['http://example.com/rss'])]
+[('http://example.com/rss', 200, u't')]
+>>> [(r.url, r.status, r.data) for r in poller.poll(['http://example.com/rss'])]
+[('http://example.com/rss', 304, None)]
+>>> transport.requests[-1][1]
+{'If-None-Match': '"1"'}
+
+Validators are only kept for feeds that parsed, so that a feed which failed
+is parsed again on the next poll, even if the server answers 304.
+
+>>> transport.resources['http://example.com/bad'] = ('<html></html>', {'ETag': '"2"'})
+>>> [(r.status, r.error.__class__.__name__) for r in poller.poll(['http://example.com/bad'])]
+[(200, 'UnknownRoot')]
+>>> transport.requests[-1][1], 'http://example.com/bad' in poller.validators
+({}, False)
+>>>
+"""
+
+import time
+import threading
+import urllib2
+import Queue
+from urlparse import urlsplit
+
+from bbparser import ParserError
+from batch import _parse_one
+
+
+class FetchError(Exception):
+
+    def __init__(self, url, status, message=None):
+        Exception.__init__(self, message or "HTTP status %s fetching %s" % (status, url))
+        self.url = url
+        self.status = status
+
+
+class Response(object):
+    """Response returned by a transport, header names are lowercase."""
+
+    def __init__(self, status, headers=None, body=''):
+        self.status = status
+        self.headers = headers or dict()
+        self.body = body
+
+
+def _lower(headers):
+    return dict((k.lower(), v) for k, v in headers.items())
+
+
+class Transport(object):
+    """Base transport, fetch() is called from several threads at once."""
+
+    def fetch(self, url, headers):
+        """Returns a Response for url, sending the request headers."""
+        raise NotImplementedError
+
+
+class UrllibTransport(Transport):
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+
+    def fetch(self, url, headers):
+        request = urllib2.Request(url, headers=headers)
+        try:
+            f = urllib2.urlopen(request, timeout=self.timeout)
+        except urllib2.HTTPError, e:
+            # urllib2 raises for 304 too
+            return Response(e.code, _lower(e.info()))
+        try:
+            return Response(f.code or 200, _lower(f.info()), f.read())
+        finally:
+            f.close()
+
+
+class LocalTransport(Transport):
+    """In process transport serving a dictionary of url: (body, headers),
+    which honours conditional requests and records all requests."""
+
+    def __init__(self, resources=None):
+        self.resources = resources or dict()
+        self.requests = list()
+
+    def fetch(self, url, headers):
+        self.requests.append((url, dict(headers)))
+        if not url in self.resources:
+            return Response(404)
+        body, response_headers = self.resources[url]
+        response_headers = _lower(response_headers)
+        etag = response_headers.get('etag')
+        modified = response_headers.get('last-modified')
+        if etag and headers.get('If-None-Match') == etag:
+            return Response(304, response_headers)
+        if modified and headers.get('If-Modified-Since') == modified:
+            return Response(304, response_headers)
+        return Response(200, response_headers, body)
+
+
+class PollResult(object):
+    """Result of polling a URL.
+
+    status is the HTTP status or None if the request failed, data is the
+    dictionary returned by Feed.as_dict() for changed feeds and error is set
+    if the feed could not be fetched or parsed.
+    """
+
+    def __init__(self, url, status, data=None, error=None):
+        self.url = url
+        self.status = status
+        self.data = data
+        self.error = error
+
+    def __repr__(self):
+        return "<PollResult %s %s>" % (self.url, self.error or self.status)
+
+    @property
+    def modified(self):
+        return self.status != 304
+
+
+class _ParseTask(object):
+    """Feed sent to the parsing pool, finished exactly once, by the pool
+    callback or by poll() when it waited longer than the parse timeout."""
+
+    def __init__(self, poller, url, status, headers, results, tasks):
+        self.poller = poller
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.results = results
+        self.tasks = tasks
+        self.deadline = time.time() + poller.parse_timeout
+        self.done = False
+
+    def finish(self, result):
+        poller = self.poller
+        poller._lock.acquire()
+        try:
+            if self.done:
+                return
+            self.done = True
+            self.tasks.discard(self)
+        finally:
+            poller._lock.release()
+        try:
+            url, data, error = result
+            if error is None:
+                poller._store_validators(url, self.headers)
+            self.results.put(PollResult(url, self.status, data, error))
+        finally:
+            poller._pending.release()
+
+    def expire(self):
+        self.finish((self.url, None, ParserError("parsing %s did not complete in %s seconds" % (self.url, self.poller.parse_timeout))))
+
+
+class FeedPoller(object):
+    """Polls many feeds concurrently.
+
+    concurrency is the number of fetches in progress at once, per_host the
+    number for a single host. processes is the size of the parsing pool
+    (None for the number of CPUs, 0 to parse in the fetching threads) and
+    max_pending the number of bodies waiting to be parsed, after which
+    fetching pauses. parse_timeout is the number of seconds after which a
+    feed still waiting for the pool is reported as failed, in case its
+    worker died. The other arguments are passed to parse().
+
+    validators maps each URL to the (etag, last_modified) tuple of its last
+    fetch, and can be saved and restored between runs.
+    """
+
+    def __init__(
+        self, transport=None, concurrency=32, per_host=2, processes=None,
+        max_pending=None, feedparser_compat=True, fields=None, parse_timeout=300):
+        self.transport = transport or UrllibTransport()
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.processes = processes
+        self.max_pending = max_pending
+        self.feedparser_compat = feedparser_compat
+        self.fields = fields
+        self.parse_timeout = parse_timeout
+        self.validators = dict()
+        self._hosts = dict()
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = None
+
+    def close(self):
+        """Stops the parsing processes."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def _start(self):
+        if self.processes == 0 or self._pool is not None:
+            return
+        import multiprocessing
+        self._pool = multiprocessing.Pool(self.processes)
+        size = self.max_pending or 2 * (self.processes or multiprocessing.cpu_count())
+        self._pending = threading.BoundedSemaphore(size)
+
+    def _host(self, url):
+        host = urlsplit(url)[1].lower()
+        self._lock.acquire()
+        try:
+            semaphore = self._hosts.get(host)
+            if semaphore is None:
+                semaphore = self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return semaphore
+        finally:
+            self._lock.release()
+
+    def _request_headers(self, url):
+        headers = dict()
+        etag, modified = self.validators.get(url, (None, None))
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+        return headers
+
+    def _store_validators(self, url, headers):
+        self._lock.acquire()
+        try:
+            self.validators[url] = (headers.get('etag'), headers.get('last-modified'))
+        finally:
+            self._lock.release()
+
+    def _poll_one(self, url, results, tasks):
+        host = self._host(url)
+        host.acquire()
+        try:
+            response = self.transport.fetch(url, self._request_headers(url))
+        except Exception, e:
+            results.put(PollResult(url, None, error=e))
+            return
+        finally:
+            host.release()
+        if response.status == 304:
+            results.put(PollResult(url, 304))
+            return
+        if not 200 <= response.status < 300:
+            results.put(PollResult(url, response.status, error=FetchError(url, response.status)))
+            return
+        headers = response.headers
+        task = (url, response.body, headers, self.feedparser_compat, self.fields)
+        if self._pool is None:
+            url, data, error = _parse_one(task)
+            if error is None:
+                self._store_validators(url, headers)
+            results.put(PollResult(url, response.status, data, error))
+            return
+        # wait for the parsing pool to catch up
+        self._pending.acquire()
+        parse_task = _ParseTask(self, url, response.status, headers, results, tasks)
+        self._lock.acquire()
+        try:
+            tasks.add(parse_task)
+        finally:
+            self._lock.release()
+        try:
+            self._pool.apply_async(_parse_one, (task,), callback=parse_task.finish)
+        except Exception, e:
+            parse_task.finish((url, None, ParserError("%s: %s" % (e.__class__.__name__, e))))
+
+    def _expire(self, tasks):
+        now = time.time()
+        self._lock.acquire()
+        try:
+            expired = [t for t in tasks if t.deadline < now]
+        finally:
+            self._lock.release()
+        for task in expired:
+            task.expire()
+
+    def _worker(self, urls, results, tasks, stop):
+        while not stop.isSet():
+            try:
+                url = urls.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                self._poll_one(url, results, tasks)
+            except Exception, e:
+                results.put(PollResult(url, None, error=e))
+
+    def poll(self, urls):
+        """Fetches urls and yields a PollResult for each, in the order they
+        complete."""
+        urls = list(urls)
+        self._start()
+        queue = Queue.Queue()
+        for url in urls:
+            queue.put(url)
+        results = Queue.Queue()
+        # feeds waiting for the parsing pool
+        tasks = set()
+        stop = threading.Event()
+        threads = list()
+        for i in range(min(self.concurrency, len(urls))):
+            t = threading.Thread(target=self._worker, args=(queue, results, tasks, stop))
+            t.setDaemon(True)
+            t.start()
+            threads.append(t)
+        try:
+            for i in range(len(urls)):
+                while True:
+                    # a timeout keeps the wait interruptible
+                    try:
+                        yield results.get(True, 1)
+                        break
+                    except Queue.Empty:
+                        if tasks:
+                            self._expire(tasks)
+                        continue
+        finally:
+            stop.set()
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
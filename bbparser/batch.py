@@ -0,0 +1,94 @@
+"""Batch parsing of many feeds over a pool of worker processes.
+
+Feed objects hold references to their ElementTree and cannot be pickled, so
+workers send back the plain data returned by Feed.as_dict().
+"""
+
+import threading
+import multiprocessing
+
+from bbparser import parse, ParserError
+
+
+def _parse_one(task):
+    index, source, headers, feedparser_compat, fields = task
+    try:
+        feed = parse(source, headers, feedparser_compat=feedparser_compat, fields=fields)
+        return index, feed.as_dict(), None
+    except ParserError, e:
+        return index, None, e
+    except Exception, e:
+        # make sure the error can be sent back to the parent process
+        return index, None, ParserError("%s: %s" % (e.__class__.__name__, e))
+
+def _parse_file(task):
+    index, path, headers, feedparser_compat, fields = task
+    try:
+        f = open(path, 'rb')
+        try:
+            source = f.read()
+        finally:
+            f.close()
+    except (IOError, OSError), e:
+        return index, None, ParserError("%s: %s" % (e.__class__.__name__, e))
+    return _parse_one((index, source, headers, feedparser_compat, fields))
+
+def _tasks(items, feedparser_compat, fields, window, stop):
+    for index, item in enumerate(items):
+        source, headers = item
+        if window is not None:
+            window.acquire()
+            if stop.isSet():
+                return
+        yield index, source, headers, feedparser_compat, fields
+
+def _map(function, items, workers, chunksize, ordered, feedparser_compat, fields, window):
+    pool = multiprocessing.Pool(workers)
+    stop = threading.Event()
+    if window is not None:
+        # the pool feeds itself from a thread and only sends full chunks
+        window = max(window, chunksize)
+        semaphore = threading.Semaphore(window)
+    else:
+        semaphore = None
+    tasks = _tasks(items, feedparser_compat, fields, semaphore, stop)
+    try:
+        if ordered:
+            results = pool.imap(function, tasks, chunksize)
+        else:
+            results = pool.imap_unordered(function, tasks, chunksize)
+        for result in results:
+            yield result
+            if semaphore is not None:
+                semaphore.release()
+        pool.close()
+    finally:
+        stop.set()
+        if semaphore is not None:
+            # unblock the thread feeding the pool
+            for i in range(window):
+                semaphore.release()
+        pool.terminate()
+        pool.join()
+
+def parse_many(items, workers=None, chunksize=8, ordered=True, feedparser_compat=True, fields=None, window=None):
+    """Parses an iterable of (source, headers) tuples using a process pool.
+
+    Yields (index, data, error) tuples, where index is the position of the
+    item in the input, data is the dictionary returned by Feed.as_dict() and
+    error is a ParserError instance if the feed could not be parsed. Results
+    are yielded in input order if ordered is true, or as soon as they are
+    ready otherwise. fields is passed to parse().
+
+    window is the largest number of items taken from the input and not yet
+    yielded, so that a large or lazy input is not read in memory all at once
+    when the results are consumed slower than they are parsed. By default
+    the pool reads the input as fast as it can.
+    """
+    return _map(_parse_one, items, workers, chunksize, ordered, feedparser_compat, fields, window)
+
+def parse_files(items, workers=None, chunksize=8, ordered=True, feedparser_compat=True, fields=None, window=256):
+    """Like parse_many(), for an iterable of (path, headers) tuples. Files
+    are read by the worker processes, an error reading a file is returned
+    as a ParserError."""
+    return _map(_parse_file, items, workers, chunksize, ordered, feedparser_compat, fields, window)
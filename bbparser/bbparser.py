@@ -2,7 +2,6 @@
 
 import re
 import codecs
-import datetime
 import copy
 import sgmlop
 import iso8601
@@ -13,130 +12,178 @@ except ImportError:
 from xml.sax.saxutils import escape, unescape
 from cgi import parse_header
 from base64 import b64decode
-from urlparse import urljoin
-from email.utils import parsedate_tz
 
-from sgmlop_treebuilder import SgmlopTreeBuilder
+from sgmlop_treebuilder import SgmlopTreeBuilder, EndTagTreeBuilder, pool
+from dates import parse_rss_date, parse_iso_date
+import tracing
+from sanitizer import SANE_TAGS, SANE_ATTRS, SANE_TAG_ATTRS, DEFAULT_POLICY, SanitizePolicy, _urljoin, sanitize
+from projection import Projection
+from errors import ParserError, NoData, UnknownRoot, LimitExceeded
+from limits import Limits
+from normalize import CP1252, normalize
+from sniff import SNIFF_SIZE, root_tag
 
 DECL_RE = re.compile(r"\<\?\s*xml\s+version=[\"|']1.0[\"|'](?:\s+encoding=[\"|'](.+?)[\"|'])?", re.I | re.S | re.M)
+# how far into the document we look for the XML declaration
+DECL_SIZE = 4096
+NON_ASCII_RE = re.compile(r'[\x80-\xff]')
+# longest first, as the UTF-32 LE BOM starts with the UTF-16 LE one
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'),
+)
 
 XML_BASE = '{http://www.w3.org/XML/1998/namespace}base'
 XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
 
-SANE_TAGS = """\
-a i em b strong p h1 h2 h3 h4 h5 ul ol dl li dt dd pre code q cite blockquote
-abbr s u img style table theader tbody tr th td div span hr br sup sub center
-caption col colgroup thead tfoot legend map area""".split()
-SANE_ATTRS = ('title', 'style', 'align', 'border',) # TODO: remove align and border when tests pass
-SANE_TAG_ATTRS = dict(a=('href', 'rel'), map=('name',), area=('coords', 'shape', 'href'), img=('src', 'alt', 'width', 'height', 'usemap'))
 STRIP_TAGS_RE = re.compile(r'<[^>]+>', re.M|re.S|re.U)
 
 UTC = iso8601.Utc()
 
-# straight from feedparser
-CP1252 = {
-    unichr(128): unichr(8364), # euro sign
-    unichr(130): unichr(8218), # single low-9 quotation mark
-    unichr(131): unichr( 402), # latin small letter f with hook
-    unichr(132): unichr(8222), # double low-9 quotation mark
-    unichr(133): unichr(8230), # horizontal ellipsis
-    unichr(134): unichr(8224), # dagger
-    unichr(135): unichr(8225), # double dagger
-    unichr(136): unichr( 710), # modifier letter circumflex accent
-    unichr(137): unichr(8240), # per mille sign
-    unichr(138): unichr( 352), # latin capital letter s with caron
-    unichr(139): unichr(8249), # single left-pointing angle quotation mark
-    unichr(140): unichr( 338), # latin capital ligature oe
-    unichr(142): unichr( 381), # latin capital letter z with caron
-    unichr(145): unichr(8216), # left single quotation mark
-    unichr(146): unichr(8217), # right single quotation mark
-    unichr(147): unichr(8220), # left double quotation mark
-    unichr(148): unichr(8221), # right double quotation mark
-    unichr(149): unichr(8226), # bullet
-    unichr(150): unichr(8211), # en dash
-    unichr(151): unichr(8212), # em dash
-    unichr(152): unichr( 732), # small tilde
-    unichr(153): unichr(8482), # trade mark sign
-    unichr(154): unichr( 353), # latin small letter s with caron
-    unichr(155): unichr(8250), # single right-pointing angle quotation mark
-    unichr(156): unichr( 339), # latin small ligature oe
-    unichr(158): unichr( 382), # latin small letter z with caron
-    unichr(159): unichr( 376), # latin capital letter y with diaeresis
-}
+# public properties returned by Feed.as_dict()
+FEED_FIELDS = (
+    'title', 'link', 'links', 'id', 'description', 'date_published', 'tags',
+    'version', 'xml_lang', 'entries', 'pubdate', 'fb_origlink',
+)
+ENTRY_FIELDS = (
+    'id', 'title', 'link', 'links', 'summary', 'content', 'date_published',
+    'tags', 'fb_origlink', 'pubdate', 'published', 'updated',
+)
 
 # TODO: sanitize element attributes where we use them like we do for tags
 # TODO: apply xml:base only if we don't have a netloc
 # TODO: check id/link attributes
 
 
-class ParserError(Exception):
-    pass
+# qualified tag names by (tag, namespace)
+_qnames = dict()
 
-class NoData(ParserError):
-    pass
-
-class UnknownRoot(ParserError):
-    pass
 
 class DummyFile(list):
     write = list.append
 
-def _urljoin(root, rel):
-    if not root:
-        return rel
-    if not rel:
-        return root
-    if root[-1] != '/':
-        root = "%s/" % root
-    if rel[0] == '/':
-        rel = rel[1:]
-    return urljoin(root, rel)
-    
 def tostring(element):
     f = DummyFile()
     t = et.ElementTree(element)
     t._write(f, t._root, 'utf8', {})
     return ''.join(f)
 
-def cleanup(elem, ns='{http://www.w3.org/1999/xhtml}', xml_base=None):
-    """http://effbot.org/zone/element-bits-and-pieces.htm"""
-    out = []
+def cleanup(elem, ns='{http://www.w3.org/1999/xhtml}', xml_base=None, policy=DEFAULT_POLICY):
+    """http://effbot.org/zone/element-bits-and-pieces.htm
+    
+    Strips the namespace and the attributes not allowed by policy from elem
+    and its descendants, and replaces the elements not allowed with their
+    text and children. The tree is walked without recursion.
+    """
     l = len(ns)
-    if elem.tag[:l] == ns:
-        elem.tag = elem.tag[l:]
-    attrib = dict()
-    xml_base = elem.attrib.get(XML_BASE, xml_base)
-    safe_attrib = SANE_ATTRS + SANE_TAG_ATTRS.get(elem.tag, tuple())
-    for k, v in elem.attrib.items():
-        if k[:l] == ns:
-            k = k[l:]
-        if not k in safe_attrib:
+    allowed = policy.tag_attrs.get
+    url_attrs = policy.url_attrs
+    # parents always come before their children
+    elements = list()
+    stack = [(elem, xml_base)]
+    while stack:
+        el, xml_base = stack.pop()
+        elements.append(el)
+        if el.tag[:l] == ns:
+            el.tag = el.tag[l:]
+        xml_base = el.attrib.get(XML_BASE, xml_base)
+        safe_attrib = allowed(el.tag) or policy.attrs
+        attrib = dict()
+        for k, v in el.attrib.items():
+            if k[:l] == ns:
+                k = k[l:]
+            if not k in safe_attrib:
+                continue
+            if k in url_attrs and xml_base:
+                # check with urlsplit that it's a relative URL
+                v = _urljoin(xml_base, v)
+            attrib[k] = v
+        el.attrib = attrib
+        stack.extend((e, xml_base) for e in el)
+    # children are cleaned up before their parent unwraps them
+    for elem in reversed(elements):
+        if not len(elem):
             continue
-        if k in ('href', 'src') and xml_base:
-            # check with urlsplit that it's a relative URL
-            v = _urljoin(xml_base, v)
-        attrib[k] = v
-    elem.attrib = attrib
-    for e in elem:
-        cleanup(e, ns, xml_base=xml_base)
-        if not e.tag in SANE_TAGS:
-            if e.text:
-                if out:
-                    out[-1].tail = u"%s%s" % (out[-1].tail or '', e.text)
-                else:
-                    if elem.text is None: # is this really necessary?
-                        elem.text = ''
-                    elem.text += e.text
-            out.extend(e)
-            if e.tail:
-                if out:
-                    out[-1].tail = out[-1].tail or ''
-                    out[-1].tail += e.tail
-                else:
-                    elem.text = "%s%s" % (elem.text or '', e.tail)
+        out = []
+        for e in elem:
+            if allowed(e.tag) is None:
+                if e.text:
+                    if out:
+                        out[-1].tail = u"%s%s" % (out[-1].tail or '', e.text)
+                    else:
+                        if elem.text is None: # is this really necessary?
+                            elem.text = ''
+                        elem.text += e.text
+                out.extend(e)
+                if e.tail:
+                    if out:
+                        out[-1].tail = out[-1].tail or ''
+                        out[-1].tail += e.tail
+                    else:
+                        elem.text = "%s%s" % (elem.text or '', e.tail)
+            else:
+                out.append(e)
+        elem[:] = out
+
+class Record(object):
+    """Compact, picklable container for the values extracted from a feed or
+    an entry, without references to the ElementTree they came from.
+    
+    Fields that were not parsed, because they are outside the projection
+    passed to parse(), raise AttributeError when read.
+    
+    >>> r = EntryRecord(title=u'title')
+    >>> r.title, r.as_dict()
+    (u'title', {'title': u'title'})
+    >>> r.link
+    Traceback (most recent call last):
+    ...
+    AttributeError: field 'link' was not parsed
+    >>> 
+    """
+    
+    __slots__ = ()
+    
+    def __init__(self, **kw):
+        for name in self.__slots__:
+            if name in kw:
+                setattr(self, name, kw[name])
+    
+    def __getattr__(self, name):
+        # only called for fields that were never set
+        if name in self.__slots__:
+            raise AttributeError("field '%s' was not parsed" % name)
+        raise AttributeError(name)
+    
+    def _items(self):
+        return [(name, getattr(self, name)) for name in self.__slots__ if hasattr(self, name)]
+    
+    def __getstate__(self):
+        return dict(self._items())
+    
+    def __setstate__(self, state):
+        if not isinstance(state, dict):
+            state = zip(self.__slots__, state)
         else:
-            out.append(e)
-    elem[:] = out
+            state = state.items()
+        for name, value in state:
+            setattr(self, name, value)
+    
+    def __repr__(self):
+        return "<%s %r>" % (self.__class__.__name__, getattr(self, 'title', None))
+    
+    def as_dict(self):
+        d = dict(self._items())
+        if 'entries' in d:
+            d['entries'] = [e.as_dict() for e in d['entries']]
+        return d
+
+class FeedRecord(Record):
+    __slots__ = FEED_FIELDS + ('warnings', 'truncated')
+
+class EntryRecord(Record):
+    __slots__ = ENTRY_FIELDS
 
 class FeedBase(type):
     """Metaclass for feed types."""
@@ -157,12 +204,20 @@ class FeedBase(type):
                 else:
                     namespace = ''
                 Feed._feed_map["%s%s" % (namespace, root_element)] = new_class
+        tracing.register(new_class)
         return new_class
         
 
 class Feed(object):
     
     _feed_map = dict()
+    _fields = FEED_FIELDS
+    tracer = None
+    projection = None
+    policy = DEFAULT_POLICY
+    limits = None
+    # true if parsing stopped at an entry past max_entries
+    truncated = False
     __metaclass__ = FeedBase
 
     def __init__(self, tree, ns, warnings=list(), xml_base='', feedparser_compat=True):
@@ -174,33 +229,101 @@ class Feed(object):
         self.feedparser_compat = feedparser_compat
     
     @classmethod
-    def factory(cls, tree, warnings, feedparser_compat=True):
+    def factory(cls, tree, warnings, feedparser_compat=True, tracer=None, projection=None, policy=None, limits=None):
         ns = None
         tag = tree.tag
         if tag[0] == '{':
             ns, sep, tag = tag[1:].rpartition('}')
         if not tree.tag in cls._feed_map:
             raise UnknownRoot("Cannot parse feed with root '%s'." % tag)
-        return cls._feed_map[tree.tag](tree, ns, warnings, feedparser_compat=feedparser_compat)
+        feed = cls._feed_map[tree.tag](tree, ns, warnings, feedparser_compat=feedparser_compat)
+        if tracer is not None:
+            tracing.enable()
+        feed.tracer = tracer
+        feed.projection = projection
+        if policy is not None:
+            feed.policy = policy
+        if limits is not None:
+            feed.limits = limits
+        return feed
+    
+    def _init_entry(self, entry):
+        # entries share the options of their feed
+        entry.tracer = self.tracer
+        entry.projection = self.projection
+        entry.policy = self.policy
+        entry.limits = self.limits
+        return entry
+    
+    def _values(self, convert):
+        d = dict()
+        for name in self._fields:
+            if self.projection is not None and not name in self.projection:
+                # the elements for this field were not parsed
+                continue
+            value = getattr(self, name)
+            if name == 'entries':
+                value = [convert(e) for e in value or tuple()]
+            d[name] = value
+        if self._fields is FEED_FIELDS:
+            d['warnings'] = list(self.warnings)
+            d['truncated'] = self.truncated
+        return d
+    
+    def as_dict(self):
+        """Returns the public properties as plain data, which unlike feed
+        objects can be pickled and sent across processes."""
+        return self._values(lambda e: e.as_dict())
+    
+    def materialize(self):
+        """Computes all public properties once and returns them in a record,
+        so that the tree can be released."""
+        values = self._values(lambda e: e.materialize())
+        if self._fields is FEED_FIELDS:
+            return FeedRecord(**values)
+        return EntryRecord(**values)
     
     def _ns_join(self, tag, ns=None):
         ns = ns or self.ns
-        if ns is None:
-            return tag
-        return "{%s}%s" % (ns, tag)
+        key = (tag, ns)
+        qname = _qnames.get(key)
+        if qname is None:
+            if len(_qnames) > 4096:
+                _qnames.clear()
+            if ns is None:
+                qname = tag
+            else:
+                qname = "{%s}%s" % (ns, tag)
+            _qnames[key] = qname
+        return qname
+    
+    def _index(self):
+        """Returns a dictionary of the direct children of the tree by
+        qualified tag, built on first use."""
+        index = self.__dict__.get('_child_index')
+        if index is None:
+            index = self._child_index = dict()
+            for el in self.tree:
+                if el.tag in index:
+                    index[el.tag].append(el)
+                else:
+                    index[el.tag] = [el]
+        return index
+    
+    def _reset_index(self):
+        self.__dict__.pop('_child_index', None)
+    
+    def _find(self, tag, ns=None):
+        children = self._index().get(self._ns_join(tag, ns))
+        if children:
+            return children[0]
+    
+    def _findall(self, tag, ns=None):
+        return self._index().get(self._ns_join(tag, ns), ())
     
     def _cp1252(self, s):
-        if not s:
-            return s
-        # straight from feedparser
-        # address common error where people take data that is already
-        # utf-8, presume that it is iso-8859-1, and re-encode it.
-        try:
-            s = s.encode('iso-8859-1').decode('utf-8')
-        except (UnicodeEncodeError, UnicodeDecodeError):
-            pass
-        s = s.replace('\r\n', '\n')
-        return u''.join(CP1252.get(c, c) for c in s)
+        # fixes utf-8 read as iso-8859-1, line endings and cp1252 characters
+        return normalize(s)
     
     def _element_to_string(self, el):
         """
@@ -226,6 +349,7 @@ class Feed(object):
             buffer.append(tostring(e).decode('utf8'))
         return u''.join(buffer)
     
+    @tracing.traced('sanitize')
     def _sanitize_text(self, text, rss_text=False):
         """
         >>> f = Feed(et.XML('<doc />'), list(), None, None)
@@ -239,37 +363,32 @@ class Feed(object):
         u'<p><br /><em title="valid attr">valid &amp; <a href="">inside</a> dummy</em></p>'
         >>> 
         """
-        # TODO: use a custom parser so that we do not have to build a tree then
-        # loop on each of its elements
-        tb = SgmlopTreeBuilder(skip_ns=('http://www.w3.org/1999/xhtml',))
-        tb.feed(u'<div>%s</div>' % text)
-        tree = tb.close()
-        if not self.feedparser_compat or not rss_text:
-            cleanup(tree, xml_base=self.xml_base)
-            return tostring(tree).decode('utf8')[5:-6].strip()
-        # use the following instead of the two preceding lines to leave
-        # simple text unescaped
-        if len(tree) > 0:
-            cleanup(tree, xml_base=self.xml_base)
-            return tostring(tree).decode('utf8')[5:-6].strip()
-        else:
-            return '' if tree.text is None else tree.text.strip()
+        limits = self.limits
+        if limits is not None:
+            # properties are computed after parse() has returned, where
+            # LimitExceeded is not expected, so content is cut instead
+            limits = limits.as_partial()
+            text = limits.truncate(text, limits.max_text, 'text', self.warnings)
+        return sanitize(
+            text, self.xml_base, self.feedparser_compat and rss_text,
+            self.policy, limits, self.warnings)
     
     @property
     def fb_origlink(self):
         # should be moved to entry classes and renamed, but I don't care...
         if not hasattr(self, '_fb_origlink'):
-            el = self.tree.find('{http://rssnamespace.org/feedburner/ext/1.0}origlink')
+            el = self._find('origlink', 'http://rssnamespace.org/feedburner/ext/1.0')
             self._fb_origlink = None
             if el is not None and isinstance(el.text, basestring):
                 self._fb_origlink = el.text.strip()
         return self._fb_origlink
 
     @property
+    @tracing.traced('tags', '_tags')
     def tags(self):
         if not hasattr(self, '_tags'):
             _tags = list()
-            for el in self.tree.findall(self._ns_join('category')):
+            for el in self._findall('category'):
                 tag = dict(term=None, scheme=None, label=None)
                 if isinstance(el.text, basestring):
                     tag['term'] = el.text.strip()
@@ -281,7 +400,7 @@ class Feed(object):
                 if tag['term'] and tag not in _tags:
                     _tags.append(tag)
             # check dc:subject too
-            for el in  self.tree.findall(self._ns_join('subject', 'http://purl.org/dc/elements/1.1/')):
+            for el in self._findall('subject', 'http://purl.org/dc/elements/1.1/'):
                 if len(el) > 0:
                     # should not happen
                     text = self._element_to_string(el)
@@ -298,6 +417,9 @@ class Feed(object):
 
 class Atom(Feed):
     
+    # rss only
+    pubdate = None
+    
     def __init__(self, tree, ns, warnings, xml_base='', feedparser_compat=True):
         super(Atom, self).__init__(tree, ns, warnings, xml_base, feedparser_compat=True)
         if self.ns == 'http://www.w3.org/2005/Atom':
@@ -311,7 +433,7 @@ class Atom(Feed):
     def links(self):
         if not hasattr(self, '_links'):
             links = list()
-            for el in self.tree.findall(self._ns_join('link')):
+            for el in self._findall('link'):
                 link = dict(href='', type='', rel='alternate', title='')
                 link.update(el.attrib)
                 if link['href']:
@@ -341,7 +463,7 @@ class Atom(Feed):
     @property
     def title(self):
         if not hasattr(self, '_title'):
-            el = self.tree.find(self._ns_join('title'))
+            el = self._find('title')
             self._title = self._element_text(el) if el is not None else None
         return self._title
     
@@ -349,8 +471,8 @@ class Atom(Feed):
     def id(self):
         # TODO: relative URLs
         if not hasattr(self, '_id'):
-            el = self.tree.find(self._ns_join('id'))
-            if el and el.text is not None:
+            el = self._find('id')
+            if el is not None and el.text is not None:
                 self._id = STRIP_TAGS_RE.sub('', el.text)
             else:
                 self._id = None
@@ -362,7 +484,7 @@ class Atom(Feed):
             if not is_text:
                 self.warnings.append("Element '%s' of type 'html' has child elements." % el.tag)
             # regenerate it as string, but clean up namespaces etc. first
-            cleanup(el, "{%s}" % self.ns, xml_base=self.xml_base)
+            cleanup(el, "{%s}" % self.ns, xml_base=self.xml_base, policy=self.policy)
             text = self._element_to_string(el)
             if is_text:
                 text = escape(text)
@@ -379,7 +501,7 @@ class Atom(Feed):
         return self._sanitize_text(text)
     
     def _element_text_xhtml(self, el, xml_base=None):
-        cleanup(el, xml_base=xml_base)
+        cleanup(el, xml_base=xml_base, policy=self.policy)
         return self._element_to_string(el)
         
     def _element_text(self, el):
@@ -429,13 +551,16 @@ class Atom(Feed):
     
 class AtomEntry(Atom):
     
+    _fields = ENTRY_FIELDS
+    
     def __init__(self, *args, **kw):
         super(AtomEntry, self).__init__(*args, **kw)
     
     @property
+    @tracing.traced('summary', '_summary')
     def summary(self):
         if not hasattr(self, '_summary'):
-            el = self.tree.find(self._ns_join('summary'))
+            el = self._find('summary')
             self._summary = self._element_text(el) if el is not None else None
         return self._summary
         
@@ -448,12 +573,13 @@ class AtomEntry(Atom):
     #   http://www.xml.com/lpt/a/1633
     
     @property
+    @tracing.traced('content', '_content')
     def content(self):
         # TODO: check older versions of atom against the rfc
         # "atom:entry elements MUST NOT contain more than one atom:content element"
         if not hasattr(self, '_content'):
             _content = list()
-            for el in self.tree.findall(self._ns_join('content')):
+            for el in self._findall('content'):
                 content = {'type':'text', 'language':'', 'value':''}
                 content.update(el.attrib)
                 content['value'] = self._element_text(el) if el is not None else None
@@ -489,18 +615,16 @@ class AtomEntry(Atom):
     def date_published(self):
         return self.published or self.issued or self.updated
 
+    @tracing.traced('date', '_%s')
     def _get_date_element(self, name):
         _name = '_%s' % name
         if not hasattr(self, _name):
-            el = self.tree.find(self._ns_join(name))
+            el = self._find(name)
             value = None
             if el is not None and el.text is not None:
-                try:
-                    value = iso8601.parse_date(el.text)
-                except (ValueError, iso8601.ParseError):
+                value = parse_iso_date(el.text)
+                if value is None:
                     self.warnings.append("Incorrect '%s' format '%s'" % (name, el.text))
-                else:
-                    value = value.astimezone(UTC)
             setattr(self, _name, value)
             return value
         return getattr(self, _name)
@@ -509,6 +633,10 @@ class AtomEntry(Atom):
 class AtomFeed(Atom):
     
     _root_element = 'feed'
+    _entry_element = 'entry'
+    # fields of the other formats, so that all feeds have the same fields
+    description = None
+    date_published = None
     _namespaces = (
         'http://www.w3.org/2005/Atom', 'http://purl.org/atom/ns#',
         'http://example.com/newformat#', 'http://example.com/necho',
@@ -524,24 +652,28 @@ class AtomFeed(Atom):
     def entries(self):
         if not hasattr(self, '_entries'):
             _entries = list()
-            for el in self.tree.findall(self._ns_join('entry')):
-                _entries.append(AtomEntry(el, self.ns, self.warnings, xml_base=self.xml_base))
+            for el in self._findall('entry'):
+                _entries.append(self._entry_factory(el))
             self._entries = _entries
         return self._entries
+
+    @property
+    def version(self):
+        return self.atom_version
+
+    def _is_entry(self, el, parent):
+        return parent is self.tree and el.tag == self._ns_join('entry')
+
+    def _entry_factory(self, el):
+        return self._init_entry(AtomEntry(el, self.ns, self.warnings, xml_base=self.xml_base))
         
 
 class Rss(Feed):
 
-    _two_digit_year_re = re.compile(r'\s\d{2}\s\d{2}:\d{2}:\d{2}\s')
-    _stupid_date_re = (
-        re.compile(r'(?P<day>[0-9]{2})\.(?P<month>[0-9]{2})\.(?P<year>[0-9]{4})\s\-\s(?P<hour>[0-9]{2}):(?P<minute>[0-9]{2})', re.M|re.S),
-        re.compile(r'\s*(?P<month>[0-9]{2})\s+(?P<day>[0-9]{2})\s+(?P<year>[0-9]{4})\s+(?P<hour>[0-9]{2}):(?P<minute>[0-9]{2}):(?P<second>[0-9]{2})(?:\s+[A-Za-z0-9+.-]+)?\s*', re.M|re.S),
-    )
-    
     def _element_text(self, el):
         if len(el) > 0:
             # we have child elements, let's clean them up
-            cleanup(el, "{%s}" % self.ns, xml_base=self.xml_base)
+            cleanup(el, "{%s}" % self.ns, xml_base=self.xml_base, policy=self.policy)
             text = self._element_to_string(el)
             return text
         else:
@@ -553,72 +685,23 @@ class Rss(Feed):
             return u''
         return self._sanitize_text(self._cp1252(text), True)
     
-    def _stupid_date_fix(self, d):
-        t = datetime.date.today()
-        defaults = dict(year=t.year, month=t.month, day=t.day, hour=0, minute=0, second=0)
-        for k, v in defaults.items():
-            if not k in d:
-                d[k] = v
-        for k, v in d.items():
-            if v and isinstance(v, basestring):
-                # check if we have a leading zero
-                if v[0] == '0':
-                    v = v[1:]
-                try:
-                    d[k] = int(v)
-                except (TypeError, ValueError):
-                    d[k] = defaults.get(k)
-            else:
-                d[k] = defaults.get(k)
-        d['tzinfo'] = iso8601.UTC
-        try:
-            return datetime.datetime(**d)
-        except (TypeError, ValueError):
-            return None
-        
+    @tracing.traced('date', '_%s')
     def _get_date_element(self, name):
         _name = '_%s' % name
         if not hasattr(self, _name):
-            el = self.tree.find(self._ns_join(name))
+            el = self._find(name)
             value = None
             if el is not None and el.text is not None:
-                d = parsedate_tz(el.text)
-                if isinstance(d, tuple):
-                    if self._two_digit_year_re.search(el.text):
-                        d = ((d[0] + 2000),) + d[1:]
-                    try:
-                        value = datetime.datetime(*(d[:-3] + (iso8601.UTC,))) - datetime.timedelta(seconds=d[-1])
-                    except TypeError, e:
-                        value = datetime.datetime(*(d[:-3] + (iso8601.UTC,)))
-                        self.warnings.append("Incorrect '%s' format '%s' timetuple '%s', error %s" % (name, el.text, d, e))
-                    except ValueError:
-                        pass
-                if value is None:
-                    # try with iso8601
-                    try:
-                        value = iso8601.parse_date(el.text)
-                    except (ValueError, iso8601.ParseError):
-                        pass
-                    else:
-                        value = value.astimezone(UTC)
-                if value is None:
-                    # try with the stupid formats seen in the wild
-                    for r in self._stupid_date_re:
-                        m = r.match(el.text)
-                        if m:
-                            value = self._stupid_date_fix(m.groupdict())
-                            if value:
-                                break
+                value, error = parse_rss_date(el.text)
+                if error:
+                    self.warnings.append("Incorrect '%s' format '%s' %s" % (name, el.text, error))
             else:
                 # look for dc:date
-                el = self.tree.find(self._ns_join('date', 'http://purl.org/dc/elements/1.1/'))
+                el = self._find('date', 'http://purl.org/dc/elements/1.1/')
                 if el is not None and el.text is not None:
-                    try:
-                        value = iso8601.parse_date(el.text)
-                    except (ValueError, iso8601.ParseError):
+                    value = parse_iso_date(el.text)
+                    if value is None:
                         self.warnings.append("Incorrect '%s' format '%s'" % (name, el.text))
-                    else:
-                        value = value.astimezone(UTC)
             if el is not None and value is None:
                 self.warnings.append("Incorrect '%s' format '%s'" % (name, el.text if el is not None else ''))
             setattr(self, _name, value)
@@ -628,16 +711,16 @@ class Rss(Feed):
     @property
     def title(self):
         if not hasattr(self, '_title'):
-            el = self.tree.find(self._ns_join('title'))
+            el = self._find('title')
             if el is None:
-                el = self.tree.find(self._ns_join('title', 'http://purl.org/dc/elements/1.1/'))
+                el = self._find('title', 'http://purl.org/dc/elements/1.1/')
             self._title = self._element_text(el) if el is not None else None
         return self._title
         
     @property
     def link(self):
         if not hasattr(self, '_link'):
-            el = self.tree.find(self._ns_join('link'))
+            el = self._find('link')
             if el is not None:
                 self._link = el.text if len(el) == 0 else None
             else:
@@ -660,6 +743,9 @@ class Rss(Feed):
 class RssFeed(Rss):
     
     _root_element = 'rss'
+    _entry_element = 'item'
+    # rss channels have no id
+    id = None
     _namespaces = (
         None, 'http://backend.userland.com/rss',
         'http://backend.userland.com/rss2',
@@ -684,9 +770,10 @@ class RssFeed(Rss):
         return self.description
         
     @property
+    @tracing.traced('description', '_description')
     def description(self):
         if not hasattr(self, '_description'):
-            el = self.tree.find(self._ns_join('description'))
+            el = self._find('description')
             self._description = self._element_text(el) if el is not None else None
         return self._description
     
@@ -694,14 +781,25 @@ class RssFeed(Rss):
     def entries(self):
         if not hasattr(self, '_entries'):
             _entries = list()
-            for el in self.tree.findall(self._ns_join('item')):
-                _entries.append(RssEntry(el, self.ns, self.warnings))
+            for el in self._findall('item'):
+                _entries.append(self._entry_factory(el))
             self._entries = _entries
         return self._entries
 
+    def _is_entry(self, el, parent):
+        return parent is self.tree and el.tag == self._ns_join('item')
+
+    def _entry_factory(self, el):
+        return self._init_entry(RssEntry(el, self.ns, self.warnings))
+
 
 class RssEntry(Rss):
     
+    _fields = ENTRY_FIELDS
+    # atom only
+    published = None
+    updated = None
+    
     def __init__(self, *args, **kw):
         super(RssEntry, self).__init__(*args, **kw)
         self._guid_is_link = True
@@ -718,7 +816,7 @@ class RssEntry(Rss):
     def guid(self):
         # TODO: relative URL
         if not hasattr(self, '_guid'):
-            el = self.tree.find(self._ns_join('guid'))
+            el = self._find('guid')
             if el is not None:
                 self._guid = el.text if len(el) == 0 else None
                 if el.attrib.get('ispermalink') == 'false':
@@ -730,15 +828,16 @@ class RssEntry(Rss):
     id = guid
     
     @property
+    @tracing.traced('summary', '_description')
     def description(self):
         if not hasattr(self, '_description'):
-            el = self.tree.find(self._ns_join('description'))
+            el = self._find('description')
             if el is None:
-                el = self.tree.find(self._ns_join('description', 'http://purl.org/dc/elements/1.1/'))
+                el = self._find('description', 'http://purl.org/dc/elements/1.1/')
             if el is None:
-                el = self.tree.find(self._ns_join('summary', 'http://www.w3.org/2005/Atom'))
+                el = self._find('summary', 'http://www.w3.org/2005/Atom')
             if el is not None:
-                cleanup(el, xml_base=self.xml_base)
+                cleanup(el, xml_base=self.xml_base, policy=self.policy)
                 self._description = self._element_text(el)
             else:
                 self._description = None
@@ -747,6 +846,7 @@ class RssEntry(Rss):
     summary = description
     
     @property
+    @tracing.traced('content', '_content')
     def content(self):
         if not hasattr(self, '_content'):
             _content = list()
@@ -757,12 +857,12 @@ class RssEntry(Rss):
                 ('encoded', 'http://purl.org/rss/1.0/modules/content/', 'text/html'),
             )
             for tag, ns, content_type in tags:
-                el = self.tree.find(self._ns_join(tag, ns))
+                el = self._find(tag, ns)
                 if el is None:
                     continue
                 content = {'type':content_type, 'language':'', 'value':''}
                 content.update(el.attrib)
-                cleanup(el, xml_base=self.xml_base)
+                cleanup(el, xml_base=self.xml_base, policy=self.policy)
                 content['value'] = self._element_text(el)
                 _content.append(content)
             if not _content and self.summary:
@@ -803,10 +903,16 @@ class RdfFeed(RssFeed):
         if not hasattr(self, '_entries'):
             _entries = list()
             for el in self._tree.findall(self._ns_join('item')):
-                _entries.append(RdfEntry(el, self.ns, self.warnings, rdf_ns=self._ns))
+                _entries.append(self._entry_factory(el))
             self._entries = _entries
         return self._entries
 
+    def _is_entry(self, el, parent):
+        return parent is self._tree and el.tag == self._ns_join('item')
+
+    def _entry_factory(self, el):
+        return self._init_entry(RdfEntry(el, self.ns, self.warnings, rdf_ns=self._ns))
+
 
 class RdfEntry(RssEntry):
     
@@ -824,8 +930,17 @@ class RdfEntry(RssEntry):
 
 # TODO: move the following to be Feed class methods?
 
-def decode(source, headers):
-    warnings = list()
+def _charsets(source, headers, warnings):
+    """Returns the candidate charsets for source, in order of preference.
+    
+    Only the byte order mark, the first DECL_SIZE bytes and the HTTP headers
+    are looked at, the source is never decoded here.
+    """
+    bom_charset = None
+    for bom, charset in BOMS:
+        if source.startswith(bom):
+            bom_charset = charset
+            break
     content_type = headers.get('content-type', '')
     http_charset = None
     if content_type:
@@ -838,7 +953,7 @@ def decode(source, headers):
             warnings.append("unknown HTTP encoding %s" % http_charset)
             http_charset = None
     xml_charset = None
-    m = DECL_RE.search(source)
+    m = DECL_RE.search(source, 0, DECL_SIZE)
     if m and m.group(1):
         try:
             xml_charset = codecs.lookup(m.group(1)).name
@@ -858,57 +973,238 @@ def decode(source, headers):
         charsets = [xml_charset, 'iso-8859-15']
     else:
         charsets = [xml_charset, 'utf-8']
-    charsets = set(charsets)
-    for c in charsets:
-        if not c:
-            continue
+    ordered = list()
+    for c in [bom_charset] + charsets:
+        if c and not c in ordered:
+            ordered.append(c)
+    return ordered, http_charset, xml_charset
+
+def _utf8_boundary(data):
+    """Returns data without a UTF-8 sequence cut at its end, at most three
+    bytes are dropped.
+    
+    >>> _utf8_boundary('caff\\xc3\\xa8'), _utf8_boundary('caff\\xc3'), _utf8_boundary('\\xe2\\x80')
+    ('caff\\xc3\\xa8', 'caff', '')
+    >>> decode_utf8('caff\\xc3\\xa8 caff\\xc3\\xa8', {}, Limits(max_size=5, partial=True))
+    ('caff', ['source size 13 exceeds the limit of 5'])
+    >>> 
+    """
+    end = len(data)
+    start = end
+    while start > 0 and end - start < 3 and '\x80' <= data[start-1] <= '\xbf':
+        start -= 1
+    if start == 0 or data[start-1] < '\xc0':
+        # ASCII, or continuation bytes not preceded by a lead byte
+        return data
+    lead = data[start-1]
+    if lead < '\xe0':
+        length = 2
+    elif lead < '\xf0':
+        length = 3
+    else:
+        length = 4
+    if end - start + 1 < length:
+        return data[:start-1]
+    return data
+
+def _decode(source, headers, utf8=False, limits=None):
+    warnings = list()
+    if limits is not None:
+        size = len(source)
+        source = limits.truncate(source, limits.max_size, 'source', warnings)
+        if len(source) < size:
+            # a cut UTF-8 sequence would fail strict decoding of the whole
+            # source, other charsets lose at most a few bytes more
+            source = _utf8_boundary(source)
+    charsets, http_charset, xml_charset = _charsets(source, headers, warnings)
+    for i, c in enumerate(charsets):
+        if c == 'ascii':
+            if i < len(charsets) - 1 and NON_ASCII_RE.search(source):
+                continue
+            if utf8 and not NON_ASCII_RE.search(source):
+                # ASCII is valid UTF-8
+                return source, warnings
         try:
-            source = source.decode(c)
+            text = source.decode(c)
         except UnicodeDecodeError:
             continue
         except LookupError, e:
             warnings.append("Error decoding feed: %s" % e)
             continue
-        else:
-            encoding = c
-            break
-    if not isinstance(source, unicode):
-        warnings.append(
-            "no valid charset in %s with http_charset %s and xml charset %s" % (
-                charsets, http_charset, xml_charset)
-        )
-        for c in set(['iso-8859-15', 'utf-8']).difference(charsets):
-            try:
-                source = source.decode(c, 'replace')
-            except UnicodeDecodeError:
-                continue
-            else:
-                encoding = c
-                break
-    if not isinstance(source, unicode):
-        raise UnicodeDecodeError, "cannot decode data, tried %s" % charsets
-    return source, warnings
+        if not utf8:
+            return text, warnings
+        if c == 'utf-8':
+            # the source has been validated, we can use it as is
+            return source, warnings
+        if c == 'utf-8-sig':
+            return source[len(codecs.BOM_UTF8):], warnings
+        return text.encode('utf-8'), warnings
+    warnings.append(
+        "no valid charset in %s with http_charset %s and xml charset %s" % (
+            charsets, http_charset, xml_charset)
+    )
+    for c in ('iso-8859-15', 'utf-8'):
+        if c in charsets:
+            continue
+        try:
+            text = source.decode(c, 'replace')
+        except UnicodeDecodeError:
+            continue
+        if utf8:
+            return text.encode('utf-8'), warnings
+        return text, warnings
+    raise ParserError("cannot decode data, tried %s" % charsets)
 
-def parse(source, headers=None, try_strict=False, feedparser_compat=True):
+def decode(source, headers, limits=None):
+    """Decodes source trying each candidate charset in order.
+    
+    Strict decoding stops at the first invalid byte, and non ASCII data is
+    detected with a regular expression before trying ASCII, so that in the
+    common case the source is decoded exactly once.
+    
+    Sources larger than the max_size of limits raise LimitExceeded, or are
+    truncated if the limits allow partial results, without cutting a UTF-8
+    sequence in half.
+    """
+    return _decode(source, headers, limits=limits)
+
+def decode_utf8(source, headers, limits=None):
+    """Like decode, but returns UTF-8 encoded data.
+    
+    Sources that are already valid UTF-8 (or ASCII) are returned untouched,
+    other charsets are transcoded.
+    """
+    return _decode(source, headers, utf8=True, limits=limits)
+
+def _strict_source(source):
+    """Returns UTF-8 encoded source with an XML declaration stating UTF-8,
+    so that expat does not decode it again with the original charset."""
+    m = DECL_RE.search(source, 0, DECL_SIZE)
+    if m and m.group(1) and m.group(1).lower() not in ('utf-8', 'utf8'):
+        return source[:m.start(1)] + 'utf-8' + source[m.end(1):]
+    return source
+
+def parse(source, headers=None, try_strict=False, feedparser_compat=True, materialize=False, cache=None, tracer=None, fields=None, max_entries=None, policy=None, limits=None):
+    """Parses a feed, returning a feed object.
+    
+    If materialize is true a FeedRecord is returned instead, and the parsed
+    tree is released as soon as all the properties have been computed.
+    
+    cache can be a ParseCache instance, in which case results are always
+    materialized, and shared between calls with the same source data, so
+    they must not be modified.
+    
+    tracer receives the events for this call, instead of the global tracer.
+    
+    fields can be a list of field names or a Projection, in which case the
+    elements no requested field reads are discarded while the tree is built,
+    and as_dict() and materialize() only return the requested fields. Reading
+    any other field from a record raises AttributeError.
+    
+    If max_entries is set the tree builder stops when an entry past that
+    many starts, the rest of the document is skipped and the feed is flagged
+    as truncated.
+    
+    >>> rss = '<rss version="2.0"><channel><title>t</title>%s</channel></rss>' % ''.join(
+    ...     '<item><title>%d</title><description><item /></description></item>' % i for i in range(3))
+    >>> [(len(f.entries), f.truncated) for f in [parse(rss, max_entries=n) for n in (0, 2, 3)]]
+    [(0, True), (2, True), (3, False)]
+    >>> 
+    
+    policy is the SanitizePolicy applied to HTML content, instead of the
+    default one.
+    
+    limits is a Limits instance applied to decoding, building the tree and
+    sanitizing content. When a limit is exceeded LimitExceeded is raised,
+    or if the limits allow partial results, the feed parsed up to that point
+    is returned with a warning. HTML content is sanitized when its property
+    is first read, and is cut with a warning if it exceeds the limits.
+    Without limits the tree builder only drops elements nested deeper than
+    300 levels, as it always did.
+    
+    If try_strict is true the feed is parsed with expat first, and with
+    sgmlop if it is not well formed. try_strict can be a flag returned by
+    StrictCache.flag(), so that sources known to be broken skip expat.
+    Strict parsing cannot stop early, so try_strict is ignored if either
+    max_entries or limits is set.
+    
+    The root element is read from the start of the source before decoding
+    it, documents with a root that is not a known feed type raise
+    UnknownRoot right away.
+    """
     headers = headers or dict()
+    if tracer is None:
+        tracer = tracing.tracer
+    if fields is not None and not isinstance(fields, Projection):
+        fields = Projection(fields)
+    if cache is not None:
+        key = cache.key(source, headers, feedparser_compat, try_strict, fields, max_entries, policy, limits)
+        record = cache.get(key)
+        if record is None:
+            record = parse(
+                source, headers, try_strict, feedparser_compat, materialize=True,
+                tracer=tracer, fields=fields, max_entries=max_entries, policy=policy,
+                limits=limits)
+            cache.put(key, record, len(source))
+        elif tracer is not None:
+            tracer.event('cache_hit')
+        return record
+    feed_class = None
+    if isinstance(source, unicode):
+        root = root_tag(source[:SNIFF_SIZE].encode('utf-8'))
+    else:
+        # None unless the data starts with ASCII compatible markup
+        root = root_tag(source)
+    if root is not None:
+        feed_class = Feed._feed_map.get(root)
+        if feed_class is None:
+            raise UnknownRoot("Cannot parse feed with root '%s'." % root.rpartition('}')[2])
+    if tracer is not None:
+        tracer.start('decode', len(source))
     if not isinstance(source, unicode):
-        # convert to unicode
-        source, warnings = decode(source, headers)
+        # sgmlop wants UTF-8, only transcode if we have to
+        source, warnings = decode_utf8(source, headers, limits)
     else:
         warnings = list()
-    source = source.encode('utf8')
+        if limits is not None:
+            source = limits.truncate(source, limits.max_size, 'source', warnings)
+        source = source.encode('utf8')
+    if tracer is not None:
+        tracer.stop('decode', len(source))
+        tracer.start('tree', len(source))
     tree = None
-    if try_strict:
+    truncated = False
+    strict = None
+    if max_entries is None and limits is None and try_strict:
+        strict = False
         parsers = ((et.XMLTreeBuilder, dict()), (SgmlopTreeBuilder, dict(parser_class=sgmlop.XMLParser)))
     else:
         parsers = ((SgmlopTreeBuilder, dict(parser_class=sgmlop.XMLParser)),)
     for parser, kw in parsers:
-        p = parser(**kw)
+        if parser is SgmlopTreeBuilder:
+            p = pool.acquire(builder_class=fields and fields.builder, **kw)
+            p.tracer = tracer
+            p.max_entries = max_entries
+            if feed_class is not None:
+                p.entry_tags = (feed_class._entry_element,)
+            if limits is not None:
+                p.limits = limits
+        elif fields is not None:
+            p = parser(target=fields.builder(), **kw)
+        else:
+            p = parser(**kw)
         try:
-            p.feed(source)
+            if parser is SgmlopTreeBuilder:
+                p.feed(source)
+            else:
+                # expat stops at the first error, and sgmlop starts over
+                # from the same decoded source
+                p.feed(_strict_source(source))
             tree = p.close()
         except SyntaxError, e:
             warnings.append("Error parsing using %s: %s" % (parser, e))
+            if tracer is not None:
+                tracer.event('strict_fallback')
             continue
         except AssertionError, e:
             warnings.append("Error parsing feed: %s" % e)
@@ -916,11 +1212,174 @@ def parse(source, headers=None, try_strict=False, feedparser_compat=True):
         else:
             if hasattr(parser, 'warnings'):
                 warnings += parser.warnings
+            truncated = getattr(p, 'truncated', False)
+            if getattr(p, 'exceeded', None):
+                p.limits.exceeded(p.exceeded, warnings)
+            if parser is not SgmlopTreeBuilder:
+                strict = True
             break
+        finally:
+            if parser is SgmlopTreeBuilder:
+                pool.release(p)
+    if hasattr(try_strict, 'record') and max_entries is None and limits is None:
+        try_strict.record(strict)
+    if tracer is not None:
+        tracer.stop('tree', len(source))
     if not tree:
         raise NoData("No valid feed found, warnings: %s" % "\n".join(warnings))
     p = None
-    return Feed.factory(tree, warnings, feedparser_compat)
+    if tracer is not None:
+        tracer.start('factory')
+    feed = Feed.factory(tree, warnings, feedparser_compat, tracer, fields, policy, limits)
+    feed.truncated = truncated
+    if tracer is not None:
+        tracer.stop('factory')
+    if materialize:
+        return feed.materialize()
+    return feed
+
+
+class _EntryCollector(object):
+    """End tag callback for iterparse, turns closed item/entry elements into
+    entry objects and detaches them from the tree being built."""
+
+    def __init__(self, warnings, feedparser_compat=True, limits=None):
+        self.warnings = warnings
+        self.feedparser_compat = feedparser_compat
+        self.limits = limits
+        self.feed = None
+        self.entries = list()
+        self.builder = None
+
+    def __contains__(self, tag):
+        return tag.rpartition('}')[2] in ('item', 'entry')
+
+    def __call__(self, el, parent):
+        if self.feed is None:
+            self.feed = Feed.factory(self.builder.root, self.warnings, self.feedparser_compat, limits=self.limits)
+        if not self.feed._is_entry(el, parent):
+            return
+        self.entries.append(self.feed._entry_factory(el))
+        parent.remove(el)
+        # the feed may have indexed its children before this entry was closed
+        self.feed._reset_index()
+
+    def builder_class(self):
+        self.builder = EndTagTreeBuilder(self, self)
+        return self.builder
+
+
+def _iterchunks(chunks, size=65536):
+    if isinstance(chunks, basestring):
+        yield chunks
+    elif hasattr(chunks, 'read'):
+        while True:
+            chunk = chunks.read(size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for chunk in chunks:
+            yield chunk
+
+def iterparse(chunks, headers=None, feedparser_compat=True, head_size=1024, limits=None):
+    """Parses a feed incrementally, yielding entries as soon as they are closed.
+
+    chunks can be a string, a file-like object or an iterable of strings.
+    Entry elements are removed from the tree once their entry object has been
+    created, so that memory use does not depend on the number of entries.
+    
+    limits is a Limits instance, as for parse(). When a limit is exceeded
+    the entries closed so far are yielded, then LimitExceeded is raised or,
+    if the limits allow partial results, iteration stops with a warning.
+    
+    >>> rss = '<rss version="2.0"><channel><title>t</title>%s</channel></rss>' % ''.join(
+    ...     '<item><title>%d</title></item>' % i for i in range(3))
+    >>> [e.title for e in iterparse([rss[:50], rss[50:]])]
+    [u'0', u'1', u'2']
+    >>> [e.title for e in iterparse(rss, limits=Limits(max_elements=7, partial=True))]
+    [u'0', u'1']
+    >>> 
+    """
+    headers = headers or dict()
+    warnings = list()
+    collector = _EntryCollector(warnings, feedparser_compat, limits)
+    tb = pool.acquire(builder_class=collector.builder_class, parser_class=sgmlop.XMLParser)
+    if limits is not None:
+        tb.limits = limits
+    try:
+        for entry in _iterparse(tb, collector, chunks, headers, warnings, feedparser_compat, head_size, limits):
+            yield entry
+    finally:
+        pool.release(tb)
+
+def _iterparse(tb, collector, chunks, headers, warnings, feedparser_compat, head_size, limits=None):
+    decoder = None
+    head = list()
+    head_length = 0
+    size = 0
+    exceeded = None
+    for chunk in _iterchunks(chunks):
+        if limits is not None and limits.max_size is not None:
+            size += len(chunk)
+            if size > limits.max_size:
+                exceeded = "source size exceeds the limit of %d" % limits.max_size
+                chunk = chunk[:len(chunk) - (size - limits.max_size)]
+        if decoder is None and not isinstance(chunk, unicode):
+            # buffer enough data to find the charset
+            head.append(chunk)
+            head_length += len(chunk)
+            if head_length < head_size and not exceeded:
+                continue
+            chunk = ''.join(head)
+            decoder = _incremental_decoder(chunk, headers, warnings)
+        if decoder is not None:
+            chunk = decoder.decode(chunk)
+        tb.feed(chunk)
+        while collector.entries:
+            yield collector.entries.pop(0)
+        if exceeded or tb.exceeded:
+            break
+    if decoder is None and head:
+        chunk = ''.join(head)
+        decoder = _incremental_decoder(chunk, headers, warnings)
+        tb.feed(decoder.decode(chunk))
+    if decoder is not None:
+        tb.feed(decoder.decode('', True))
+    try:
+        tree = tb.close()
+    except AssertionError, e:
+        warnings.append("Error parsing feed: %s" % e)
+        tree = None
+    warnings += tb.warnings
+    for entry in collector.entries:
+        yield entry
+    for message in (exceeded, tb.exceeded):
+        if message:
+            limits.exceeded(message, warnings)
+    if collector.feed is None:
+        if tree is None:
+            raise NoData("No valid feed found, warnings: %s" % "\n".join(warnings))
+        # raises UnknownRoot for non feeds
+        Feed.factory(tree, warnings, feedparser_compat)
+
+def _incremental_decoder(head, headers, warnings):
+    charsets, http_charset, xml_charset = _charsets(head, headers, warnings)
+    for c in charsets + ['utf-8']:
+        try:
+            decoder = codecs.getincrementaldecoder(c)('replace')
+            codecs.getincrementaldecoder(c)().decode(head)
+        except UnicodeDecodeError:
+            continue
+        except LookupError, e:
+            warnings.append("Error decoding feed: %s" % e)
+            continue
+        return decoder
+    warnings.append(
+        "no valid charset in %s with http_charset %s and xml charset %s" % (
+            charsets, http_charset, xml_charset)
+    )
+    return codecs.getincrementaldecoder('iso-8859-15')('replace')
 
 
 def _test():
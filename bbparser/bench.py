@@ -0,0 +1,225 @@
+"""Benchmarks over a synthetic corpus of well formed and broken feeds.
+
+Run with python -m bbparser.bench, use --save to store the results as a JSON
+baseline and --compare to check a run against a saved baseline. The memo
+caches of the parser are emptied before each run, use --warm to keep them.
+"""
+
+import sys
+import time
+import random
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from bbparser import Feed, decode_utf8, _qnames
+from sgmlop_treebuilder import pool, _charrefs
+from dates import _rss_cache, _iso_cache
+import sgmlop
+
+
+STAGES = ('decode', 'tree', 'factory', 'dates', 'sanitize')
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipisicing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua caff\xc3\xa8 perch\xc3\xa9"
+).split()
+
+
+def _words(rnd, n):
+    return ' '.join(rnd.choice(WORDS) for i in range(n))
+
+def _html(rnd, paragraphs=3):
+    return ''.join(
+        '<p>%s <a href="/p/%d" onclick="x()">%s</a> <b>%s</b></p>' % (
+            _words(rnd, 20), rnd.randint(0, 1000), _words(rnd, 2), _words(rnd, 3))
+        for i in range(paragraphs)
+    )
+
+def _escape(s):
+    return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def rss20(rnd, items=50, version='2.0', description=None):
+    out = ['<?xml version="1.0" encoding="utf-8"?>\n<rss version="%s"><channel>' % version]
+    out.append('<title>%s</title><link>http://example.com/</link><description>%s</description>' % (
+        _words(rnd, 4), _words(rnd, 10)))
+    for i in range(items):
+        out.append(
+            '<item><title>%s</title><link>http://example.com/%d</link><guid>http://example.com/%d</guid>'
+            '<pubDate>Thu, %02d Jan 2009 %02d:%02d:00 +0100</pubDate><category>%s</category>'
+            '<description>%s</description></item>' % (
+                _words(rnd, 6), i, i, i % 28 + 1, i % 24, i % 60, _words(rnd, 1),
+                description(rnd) if description else _escape(_html(rnd))))
+    out.append('</channel></rss>')
+    return ''.join(out)
+
+def rss091(rnd):
+    return rss20(rnd, 15, '0.91')
+
+def rdf(rnd, items=30):
+    out = [
+        '<?xml version="1.0" encoding="utf-8"?>\n<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" '
+        'xmlns="http://purl.org/rss/1.0/" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        '<channel rdf:about="http://example.com/"><title>%s</title><link>http://example.com/</link></channel>' % _words(rnd, 4)
+    ]
+    for i in range(items):
+        out.append(
+            '<item rdf:about="http://example.com/%d"><title>%s</title><link>http://example.com/%d</link>'
+            '<dc:date>2009-01-%02dT10:00:00+01:00</dc:date><description>%s</description></item>' % (
+                i, _words(rnd, 6), i, i % 28 + 1, _escape(_html(rnd, 2))))
+    out.append('</rdf:RDF>')
+    return ''.join(out)
+
+def atom(rnd, items=50, ns='http://www.w3.org/2005/Atom', date='updated'):
+    out = [
+        '<?xml version="1.0" encoding="utf-8"?>\n<feed xmlns="%s" xml:base="http://example.com/">'
+        '<title>%s</title><link rel="alternate" href="http://example.com/"/><id>urn:feed</id>' % (ns, _words(rnd, 4))
+    ]
+    for i in range(items):
+        out.append(
+            '<entry><id>urn:entry:%d</id><title type="html">%s</title><link href="/e/%d"/>'
+            '<%s>2009-01-%02dT%02d:00:00Z</%s><summary>%s</summary>'
+            '<content type="xhtml"><div xmlns="http://www.w3.org/1999/xhtml">%s</div></content></entry>' % (
+                i, _escape(_words(rnd, 6)), i, date, i % 28 + 1, i % 24, date,
+                _words(rnd, 20), _html(rnd)))
+    out.append('</feed>')
+    return ''.join(out)
+
+def atom03(rnd):
+    return atom(rnd, 30, 'http://purl.org/atom/ns#', 'issued')
+
+def broken_utf8(rnd):
+    data = rss20(rnd, 50)
+    return ''.join(c if rnd.random() > 0.002 else '\xff' for c in data)
+
+def mojibake(rnd):
+    # utf-8 encoded cp1252 punctuation, read as latin-1 and encoded again
+    text = u'\u2019quoted\u201d \u2013 caff\xe8'.encode('utf-8').decode('latin-1').encode('utf-8')
+    return rss20(rnd, 50, description=lambda rnd: '%s %s' % (text, _words(rnd, 30)))
+
+def nested_html(rnd):
+    html = '<div>' * 200 + _words(rnd, 10) + '</div>' * 200
+    return rss20(rnd, 20, description=lambda rnd: _escape(html))
+
+def entities(rnd):
+    text = ' '.join('l&amp;rsquo;%s &amp;#39;%s&amp;#39; &amp;egrave;' % (w, w) for w in WORDS * 5)
+    return rss20(rnd, 50, description=lambda rnd: text)
+
+def huge(rnd):
+    return rss20(rnd, 2000)
+
+CORPUS = (
+    ('rss20', rss20), ('rss091', rss091), ('rdf', rdf), ('atom10', atom),
+    ('atom03', atom03), ('broken_utf8', broken_utf8), ('mojibake', mojibake),
+    ('nested_html', nested_html), ('entities', entities), ('huge', huge),
+)
+
+
+def corpus(names=None, seed=0):
+    """Returns a list of (name, data) tuples, always the same for a seed."""
+    rnd = random.Random(seed)
+    return [(name, f(rnd)) for name, f in CORPUS if not names or name in names]
+
+def clear_caches():
+    """Empties the module level caches of parsed dates, qualified names and
+    character references."""
+    _rss_cache.clear()
+    _iso_cache.clear()
+    _qnames.clear()
+    _charrefs.clear()
+
+def run_one(data, headers=None):
+    """Parses data one stage at a time, returning the time spent in each."""
+    timer = time.time
+    times = dict()
+    t = timer()
+    source, warnings = decode_utf8(data, headers or dict())
+    times['decode'] = timer() - t
+    t = timer()
+    tb = pool.acquire(parser_class=sgmlop.XMLParser)
+    try:
+        tb.feed(source)
+        tree = tb.close()
+    finally:
+        pool.release(tb)
+    times['tree'] = timer() - t
+    t = timer()
+    feed = Feed.factory(tree, warnings)
+    entries = feed.entries
+    times['factory'] = timer() - t
+    t = timer()
+    for e in entries:
+        e.date_published
+    times['dates'] = timer() - t
+    t = timer()
+    feed.title
+    for e in entries:
+        e.title
+        e.summary
+        e.content
+    times['sanitize'] = timer() - t
+    return times
+
+def run(names=None, repeat=3, warm=False):
+    """Runs the benchmark, returning a dictionary of results by corpus name,
+    using the best time out of repeat runs for each stage. Unless warm is
+    true the caches are cleared before each run, so that the later runs do
+    not reuse the dates parsed by the first one."""
+    results = dict()
+    for name, data in corpus(names):
+        best = None
+        for i in range(repeat):
+            if not warm:
+                clear_caches()
+            times = run_one(data)
+            if best is None:
+                best = times
+            else:
+                for k, v in times.items():
+                    best[k] = min(best[k], v)
+        total = sum(best.values())
+        results[name] = dict(
+            bytes=len(data), total=total, stages=best,
+            feeds_per_sec=1 / total if total else 0,
+            mb_per_sec=len(data) / total / 1048576 if total else 0,
+        )
+    return results
+
+def report(results, baseline=None, out=sys.stdout):
+    out.write("%-12s %9s %9s %8s  %s\n" % ('corpus', 'feeds/s', 'MB/s', 'vs base', '  '.join('%8s' % s for s in STAGES)))
+    for name, f in CORPUS:
+        r = results.get(name)
+        if r is None:
+            continue
+        compare = ''
+        if baseline and name in baseline:
+            compare = '%7.2fx' % (baseline[name]['total'] / r['total'])
+        out.write("%-12s %9.1f %9.2f %8s  %s\n" % (
+            name, r['feeds_per_sec'], r['mb_per_sec'], compare,
+            '  '.join('%6.1fms' % (r['stages'][s] * 1000) for s in STAGES)))
+
+def main(argv=None):
+    parser = OptionParser(usage="%prog [options] [corpus ...]")
+    parser.add_option('-r', '--repeat', type='int', default=3, help="runs per corpus, the best one is used")
+    parser.add_option('-w', '--warm', action='store_true', default=False, help="keep the caches between runs")
+    parser.add_option('-s', '--save', metavar='FILE', help="save the results as a JSON baseline")
+    parser.add_option('-c', '--compare', metavar='FILE', help="compare the results with a JSON baseline")
+    options, args = parser.parse_args(argv)
+    baseline = None
+    if options.compare:
+        baseline = json.load(open(options.compare))
+    results = run(args, options.repeat, options.warm)
+    report(results, baseline)
+    if options.save:
+        f = open(options.save, 'w')
+        try:
+            json.dump(results, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""Cache of parse results keyed on the raw feed data.
+
+Most feeds are byte identical between polls, so the result of a previous
+parse can be returned without decoding or parsing the data again.
+
+>>> cache = ParseCache(max_entries=2)
+>>> key = cache.key('<rss />', {'content-type': 'text/xml'})
+>>> cache.get(key) is None
+True
+>>> cache.put(key, 'result', 7)
+>>> cache.get(key), cache.hits, cache.misses
+('result', 1, 1)
+>>>
+
+StrictCache remembers for each source whether strict parsing succeeds, and
+skips it for sources known to be broken.
+
+>>> strict = StrictCache(retry=2)
+>>> flag = strict.flag('http://example.com/rss')
+>>> bool(flag)
+True
+>>> flag.record(False)
+>>> bool(flag), bool(strict.flag('http://example.com/atom'))
+(False, True)
+>>> flag.record(None); flag.record(None); bool(flag)
+True
+>>>
+"""
+
+import threading
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from lru import LRUCache
+
+
+class ParseCache(object):
+    """LRU cache of materialized parse results.
+
+    The size of each result is estimated from the size of its source data,
+    and results are evicted when either max_entries or max_bytes is exceeded.
+    
+    The cache can be shared between threads. The same record is returned to
+    every caller that parses the same data, and must not be modified: use
+    copy.deepcopy() on it first if needed.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64*1024*1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = LRUCache(None)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def key(self, source, headers=None, feedparser_compat=True, try_strict=False, projection=None, max_entries=None, policy=None, limits=None):
+        """Returns the cache key for a source and the options that affect
+        the result of parsing it."""
+        if isinstance(source, unicode):
+            source = source.encode('utf-8')
+        content_type = (headers or dict()).get('content-type', '')
+        return (
+            md5(source).digest(), len(source), content_type,
+            bool(feedparser_compat), bool(try_strict),
+            projection.fields if projection is not None else None,
+            max_entries, policy,
+            limits.key() if limits is not None else None,
+        )
+
+    def get(self, key):
+        self._lock.acquire()
+        try:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return item[0]
+        finally:
+            self._lock.release()
+
+    def put(self, key, value, size):
+        self._lock.acquire()
+        try:
+            old = self._items.pop(key)
+            if old is not None:
+                self.size -= old[1]
+            if size > self.max_bytes:
+                return
+            self._items[key] = (value, size)
+            self.size += size
+            while len(self._items) > self.max_entries or self.size > self.max_bytes:
+                key, (value, size) = self._items.popitem()
+                self.size -= size
+                self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._items.clear()
+            self.size = 0
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        self._lock.acquire()
+        try:
+            return dict(
+                entries=len(self._items), size=self.size, hits=self.hits,
+                misses=self.misses, evictions=self.evictions,
+            )
+        finally:
+            self._lock.release()
+
+
+class StrictFlag(object):
+    """Value for the try_strict argument of parse() bound to a source, true
+    if strict parsing should be tried. parse() calls record() with the
+    outcome, None if strict parsing was skipped."""
+
+    __slots__ = ('cache', 'key')
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+
+    def __nonzero__(self):
+        return self.cache.should_try(self.key)
+
+    def record(self, success):
+        self.cache.record(self.key, success)
+
+
+class StrictCache(object):
+    """Outcome of strict parsing for each source, usually keyed by feed URL.
+
+    After max_failures consecutive failures strict parsing is skipped for a
+    source, and tried again once every retry parses in case the feed has
+    been fixed. Sources that parse strictly take no space, and at most
+    max_sources failing ones are remembered.
+    """
+
+    def __init__(self, max_sources=4096, max_failures=1, retry=32):
+        self.max_failures = max_failures
+        self.retry = retry
+        self.tried = 0
+        self.failed = 0
+        self.skipped = 0
+        self._failing = LRUCache(max_sources)
+
+    def __len__(self):
+        return len(self._failing)
+
+    def flag(self, key):
+        """Returns the try_strict value to parse the source with key."""
+        return StrictFlag(self, key)
+
+    def should_try(self, key):
+        state = self._failing.get(key)
+        return state is None or state[0] < self.max_failures or state[1] >= self.retry
+
+    def record(self, key, success):
+        if success is None:
+            self.skipped += 1
+            state = self._failing.get(key)
+            if state is not None:
+                state[1] += 1
+            return
+        self.tried += 1
+        if success:
+            self._failing.pop(key)
+            return
+        self.failed += 1
+        state = self._failing.get(key)
+        if state is None:
+            self._failing[key] = [1, 0]
+        else:
+            state[0] += 1
+            state[1] = 0
+
+    def stats(self):
+        return dict(
+            failing=len(self._failing), tried=self.tried, failed=self.failed,
+            skipped=self.skipped,
+        )
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
@@ -0,0 +1,132 @@
+"""Date parsing for feed elements.
+
+Each date string is classified once and sent to the RFC 822 or ISO 8601
+parser first, falling back to the other formats seen in the wild. Results are
+kept in a bounded LRU cache, as feeds repeat the same dates on every poll.
+
+>>> parse_rss_date('Thu, 25 Jan 2007 12:00:00 +0100')
+(datetime.datetime(2007, 1, 25, 11, 0, tzinfo=<UTC>), None)
+>>> parse_rss_date('2007-01-25T12:00:00+01:00')
+(datetime.datetime(2007, 1, 25, 11, 0, tzinfo=<UTC>), None)
+>>> parse_rss_date('25.01.2007 - 12:00')
+(datetime.datetime(2007, 1, 25, 12, 0, tzinfo=<UTC>), None)
+>>> parse_iso_date('2007-01-25T12:00:00Z')
+datetime.datetime(2007, 1, 25, 12, 0, tzinfo=<UTC>)
+>>> parse_iso_date('yesterday') is None
+True
+>>>
+"""
+
+import re
+import datetime
+
+from email.utils import parsedate_tz
+
+import iso8601
+from lru import LRUCache
+
+
+UTC = iso8601.UTC
+
+_two_digit_year_re = re.compile(r'\s\d{2}\s\d{2}:\d{2}:\d{2}\s')
+_stupid_date_re = (
+    re.compile(r'(?P<day>[0-9]{2})\.(?P<month>[0-9]{2})\.(?P<year>[0-9]{4})\s\-\s(?P<hour>[0-9]{2}):(?P<minute>[0-9]{2})', re.M|re.S),
+    re.compile(r'\s*(?P<month>[0-9]{2})\s+(?P<day>[0-9]{2})\s+(?P<year>[0-9]{4})\s+(?P<hour>[0-9]{2}):(?P<minute>[0-9]{2}):(?P<second>[0-9]{2})(?:\s+[A-Za-z0-9+.-]+)?\s*', re.M|re.S),
+)
+
+_rss_cache = LRUCache(4096)
+_iso_cache = LRUCache(4096)
+
+
+def _stupid_date_fix(d):
+    t = datetime.date.today()
+    defaults = dict(year=t.year, month=t.month, day=t.day, hour=0, minute=0, second=0)
+    for k, v in defaults.items():
+        if not k in d:
+            d[k] = v
+    for k, v in d.items():
+        if v and isinstance(v, basestring):
+            # check if we have a leading zero
+            if v[0] == '0':
+                v = v[1:]
+            try:
+                d[k] = int(v)
+            except (TypeError, ValueError):
+                d[k] = defaults.get(k)
+        else:
+            d[k] = defaults.get(k)
+    d['tzinfo'] = UTC
+    try:
+        return datetime.datetime(**d)
+    except (TypeError, ValueError):
+        return None
+
+def _looks_iso(text):
+    return len(text) >= 10 and text[4] == '-' and text[:4].isdigit()
+
+def _rfc822(text):
+    d = parsedate_tz(text)
+    if not isinstance(d, tuple):
+        return None, None
+    if _two_digit_year_re.search(text):
+        d = ((d[0] + 2000),) + d[1:]
+    try:
+        return datetime.datetime(*(d[:-3] + (UTC,))) - datetime.timedelta(seconds=d[-1]), None
+    except TypeError, e:
+        return datetime.datetime(*(d[:-3] + (UTC,))), "timetuple '%s', error %s" % (d, e)
+    except ValueError:
+        return None, None
+
+def _iso(text):
+    try:
+        return iso8601.parse_date(text).astimezone(UTC)
+    except (ValueError, iso8601.ParseError):
+        return None
+
+def _stupid(text):
+    # try with the stupid formats seen in the wild
+    for r in _stupid_date_re:
+        m = r.match(text)
+        if m:
+            value = _stupid_date_fix(m.groupdict())
+            if value:
+                return value
+
+def parse_rss_date(text):
+    """Parses a date in any of the formats found in RSS feeds.
+
+    Returns a (datetime, error) tuple, where the datetime is in UTC or None if
+    the date could not be parsed, and error is a message describing a partial
+    failure, or None.
+    """
+    result = _rss_cache.get(text)
+    if result is not None:
+        return result
+    error = None
+    if _looks_iso(text):
+        value = _iso(text)
+        if value is None:
+            value, error = _rfc822(text)
+    else:
+        value, error = _rfc822(text)
+        if value is None:
+            value = _iso(text)
+    if value is None:
+        value = _stupid(text)
+    result = _rss_cache[text] = (value, error)
+    return result
+
+def parse_iso_date(text):
+    """Parses an ISO 8601 date, returning it in UTC or None if invalid."""
+    value = _iso_cache.get(text, _iso_cache)
+    if value is _iso_cache:
+        value = _iso_cache[text] = _iso(text)
+    return value
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
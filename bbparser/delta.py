@@ -0,0 +1,127 @@
+"""Incremental parsing against the previous state of the same feed.
+
+Entries are fingerprinted from their raw subtree before any of their
+properties are computed, so that unchanged entries are skipped without
+sanitizing their content or parsing their dates.
+"""
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from bbparser import parse
+
+
+class DeltaState(object):
+    """Compact state of a feed, to be persisted between polls.
+
+    digest is the digest of the whole source, entries maps the key of each
+    entry to the fingerprint of its subtree.
+    """
+
+    def __init__(self, digest=None, entries=None):
+        self.digest = digest
+        self.entries = entries or dict()
+
+    def __getstate__(self):
+        return self.digest, self.entries
+
+    def __setstate__(self, state):
+        self.digest, self.entries = state
+
+
+class Delta(object):
+    """Result of parse_delta.
+
+    added and modified are lists of entry objects, removed is a list of the
+    keys of entries no longer in the feed, and state is the new DeltaState.
+    feed is None if the source was identical to the previous one.
+    """
+
+    def __init__(self, feed, state, added=None, modified=None, removed=None):
+        self.feed = feed
+        self.state = state
+        self.added = added or list()
+        self.modified = modified or list()
+        self.removed = removed or list()
+
+    def __nonzero__(self):
+        return bool(self.added or self.modified or self.removed)
+
+
+def _utf8(s):
+    # the tree builder returns byte strings for ASCII names
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
+
+def fingerprint(el):
+    """Returns a digest of the tags, attributes and text of a subtree."""
+    h = md5()
+    update = h.update
+    for e in el.getiterator():
+        update(_utf8(e.tag))
+        for k, v in sorted(e.attrib.items()):
+            update("\0")
+            update(_utf8(k))
+            update("=")
+            update(_utf8(v))
+        update("\1")
+        if e.text:
+            update(_utf8(e.text))
+        update("\2")
+        if e.tail:
+            update(_utf8(e.tail))
+        update("\3")
+    return h.digest()
+
+def entry_key(entry, digest):
+    """Returns the identity of an entry: its id or guid, its link, or the
+    fingerprint of its subtree if it has neither."""
+    return entry.id or entry.link or digest
+
+def parse_delta(source, previous_state=None, headers=None, feedparser_compat=True):
+    """Parses source and returns a Delta with the entries that were added or
+    modified since previous_state, and the keys of those that were removed.
+    
+    >>> rss = '<rss version="2.0"><channel><title>t</title>%s</channel></rss>'
+    >>> item = '<item><guid>%s</guid><title>%s</title></item>'
+    >>> first = parse_delta(rss % (item % ('a', 'A') + item % ('b', 'B')))
+    >>> [e.id for e in first.added], bool(parse_delta(rss % (item % ('a', 'A') + item % ('b', 'B')), first.state))
+    ([u'a', u'b'], False)
+    >>> d = parse_delta(rss % (item % ('a', 'A2') + item % ('c', 'C')), first.state)
+    >>> [e.id for e in d.added], [e.id for e in d.modified], d.removed
+    ([u'c'], [u'a'], [u'b'])
+    >>> 
+    """
+    data = source.encode('utf-8') if isinstance(source, unicode) else source
+    digest = md5(data).digest()
+    if previous_state is not None and previous_state.digest == digest:
+        return Delta(None, previous_state)
+    previous = previous_state.entries if previous_state is not None else dict()
+    feed = parse(source, headers, feedparser_compat=feedparser_compat)
+    state = DeltaState(digest)
+    delta = Delta(feed, state)
+    for entry in feed.entries:
+        fp = fingerprint(entry.tree)
+        key = entry_key(entry, fp)
+        if key in state.entries:
+            # duplicate entry in the same feed
+            continue
+        state.entries[key] = fp
+        old = previous.get(key)
+        if old is None:
+            delta.added.append(entry)
+        elif old != fp:
+            delta.modified.append(entry)
+    delta.removed = [k for k in previous if not k in state.entries]
+    return delta
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
@@ -0,0 +1,15 @@
+"""Exceptions raised by the parser."""
+
+
+class ParserError(Exception):
+    pass
+
+class NoData(ParserError):
+    pass
+
+class UnknownRoot(ParserError):
+    pass
+
+class LimitExceeded(ParserError):
+    """Raised when a feed exceeds one of the resource limits."""
+    pass
@@ -37,6 +37,9 @@ class Utc(tzinfo):
 
     def dst(self, dt):
         return ZERO
+    
+    def __repr__(self):
+        return "<UTC>"
 UTC = Utc()
 
 class FixedOffset(tzinfo):
@@ -59,6 +62,16 @@ class FixedOffset(tzinfo):
     def __repr__(self):
         return "<FixedOffset %r>" % self.__name
 
+# FixedOffset instances are immutable, so we only need one per offset
+_offsets = dict()
+
+def fixed_offset(hours, minutes, name):
+    """Returns a shared FixedOffset instance for the given offset"""
+    tz = _offsets.get((hours, minutes))
+    if tz is None:
+        tz = _offsets.setdefault((hours, minutes), FixedOffset(hours, minutes, name))
+    return tz
+
 def parse_timezone(tzstring, default_timezone=UTC):
     """Parses ISO 8601 time zone specs into tzinfo offsets
     
@@ -76,7 +89,40 @@ def parse_timezone(tzstring, default_timezone=UTC):
     if prefix == "-":
         hours = -hours
         minutes = -minutes
-    return FixedOffset(hours, minutes, tzstring)
+    return fixed_offset(hours, minutes, tzstring)
+
+def _parse_fast(datestring, default_timezone):
+    # YYYY-MM-DDTHH:MM:SS[.fraction][Z|+HH:MM|+HHMM], which is what most
+    # feeds use, parsed by slicing; anything else goes through the regex
+    s = datestring
+    if len(s) < 19 or s[4] != '-' or s[7] != '-' or s[13] != ':' or s[16] != ':':
+        return
+    if not (s[0:4] + s[5:7] + s[8:10] + s[11:13] + s[14:16] + s[17:19]).isdigit():
+        return
+    rest = s[19:]
+    fraction = 0
+    if rest[:1] == '.':
+        i = 1
+        while i < len(rest) and rest[i].isdigit():
+            i += 1
+        if i == 1:
+            return
+        fraction = int(rest[1:i][:6].ljust(6, '0'))
+        rest = rest[i:]
+    if not rest:
+        tz = default_timezone
+    elif rest == 'Z':
+        # like parse_timezone()
+        tz = default_timezone
+    elif rest[0] in '+-' and (len(rest) == 5 or (len(rest) == 6 and rest[3] == ':')) and TIMEZONE_REGEX.match(rest):
+        tz = parse_timezone(rest)
+    else:
+        return
+    try:
+        return datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]),
+            int(s[11:13]), int(s[14:16]), int(s[17:19]), fraction, tz)
+    except ValueError:
+        raise ParseError("Unable to parse date string %r" % datestring)
 
 def parse_date(datestring, default_timezone=UTC):
     """Parses ISO 8601 dates into datetime objects
@@ -88,6 +134,9 @@ def parse_date(datestring, default_timezone=UTC):
     """
     if not isinstance(datestring, basestring):
         raise ParseError("Expecting a string %r" % datestring)
+    value = _parse_fast(datestring, default_timezone)
+    if value is not None:
+        return value
     m = ISO8601_REGEX.match(datestring)
     if not m:
         raise ParseError("Unable to parse date string %r" % datestring)
@@ -96,7 +145,7 @@ def parse_date(datestring, default_timezone=UTC):
     if groups["fraction"] is None:
         groups["fraction"] = 0
     else:
-        groups["fraction"] = int(float("0.%s" % groups["fraction"]) * 1e6)
+        groups["fraction"] = int(groups["fraction"][:6].ljust(6, "0"))
     try:
         return datetime(int(groups["year"]), int(groups["month"]), int(groups["day"]),
         int(groups["hour"]), int(groups["minute"]), int(groups["second"]),
@@ -0,0 +1,88 @@
+"""Resource limits for hostile feeds.
+
+A Limits instance caps the size of the source, the nesting depth, the number
+of elements, the number of attributes of an element and the size of the text
+of an element. Work stops as soon as a limit is exceeded, and either
+LimitExceeded is raised or, if partial is set, what was parsed so far is
+returned with a warning.
+
+>>> limits = Limits(max_size=4, partial=True)
+>>> warnings = list()
+>>> limits.truncate('<rss />', limits.max_size, 'source', warnings)
+'<rss'
+>>> warnings
+['source size 7 exceeds the limit of 4']
+>>> Limits(max_size=4).truncate('<rss />', 4, 'source', warnings)
+Traceback (most recent call last):
+    ...
+LimitExceeded: source size 7 exceeds the limit of 4
+>>>
+"""
+
+from errors import LimitExceeded
+
+
+class Limits(object):
+    """Resource limits, None means no limit.
+
+    Elements nested deeper than max_depth are not added to the tree but
+    their text is kept, nesting them more than max_depth levels further
+    exceeds the limit. max_text and max_size are in bytes of UTF-8 data,
+    or characters for unicode sources.
+    
+    Limits are off unless passed to parse(), in which case the tree builder
+    only applies its historical guard: elements nested deeper than 300
+    levels are dropped, however deep the document goes.
+    """
+
+    def __init__(
+        self, max_depth=300, max_elements=None, max_attributes=None,
+        max_text=None, max_size=None, partial=False):
+        self.max_depth = max_depth
+        self.max_elements = max_elements
+        self.max_attributes = max_attributes
+        self.max_text = max_text
+        self.max_size = max_size
+        self.partial = partial
+
+    def __repr__(self):
+        return "<Limits depth=%s elements=%s attributes=%s text=%s size=%s partial=%s>" % (
+            self.max_depth, self.max_elements, self.max_attributes,
+            self.max_text, self.max_size, self.partial)
+
+    def key(self):
+        """Returns a tuple of the limits, eg to use in cache keys."""
+        return (
+            self.max_depth, self.max_elements, self.max_attributes,
+            self.max_text, self.max_size, self.partial,
+        )
+
+    def as_partial(self):
+        """Returns limits with the same values that allow partial results."""
+        if self.partial:
+            return self
+        return Limits(
+            self.max_depth, self.max_elements, self.max_attributes,
+            self.max_text, self.max_size, partial=True)
+
+    def exceeded(self, message, warnings):
+        """Raises LimitExceeded, or adds message to warnings if partial
+        results are allowed."""
+        if not self.partial:
+            raise LimitExceeded(message)
+        warnings.append(message)
+
+    def truncate(self, data, limit, name, warnings):
+        """Returns data cut to limit, after calling exceeded if needed."""
+        if limit is not None and len(data) > limit:
+            self.exceeded("%s size %d exceeds the limit of %d" % (name, len(data), limit), warnings)
+            return data[:limit]
+        return data
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
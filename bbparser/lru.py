@@ -0,0 +1,126 @@
+"""A small thread safe LRU mapping.
+
+>>> c = LRUCache(2)
+>>> c['a'] = 1; c['b'] = 2
+>>> c.get('a')
+1
+>>> c['c'] = 3
+>>> 'b' in c, 'a' in c, len(c)
+(False, True, 2)
+>>> c.popitem()
+('a', 1)
+>>>
+"""
+
+import threading
+
+
+PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+
+class LRUCache(object):
+    """Mapping that keeps at most maxsize items, evicting the least recently
+    used ones first. A maxsize of None means no limit, so that the caller can
+    evict items itself with popitem()."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._map = dict()
+        # circular doubly linked list, the root is before the oldest link
+        self._root = root = list()
+        root[:] = [root, root, None, None]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            link = self._map.get(key)
+            if link is None:
+                return default
+            # move the link to the most recently used position
+            link_prev, link_next = link[PREV], link[NEXT]
+            link_prev[NEXT] = link_next
+            link_next[PREV] = link_prev
+            root = self._root
+            last = root[PREV]
+            last[NEXT] = root[PREV] = link
+            link[PREV] = last
+            link[NEXT] = root
+            return link[VALUE]
+        finally:
+            self._lock.release()
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._lock.acquire()
+        try:
+            link = self._map.pop(key, None)
+            if link is not None:
+                link[PREV][NEXT] = link[NEXT]
+                link[NEXT][PREV] = link[PREV]
+            root = self._root
+            last = root[PREV]
+            link = [last, root, key, value]
+            last[NEXT] = root[PREV] = self._map[key] = link
+            if self.maxsize is not None and len(self._map) > self.maxsize:
+                self._pop_oldest()
+        finally:
+            self._lock.release()
+
+    def pop(self, key, default=None):
+        self._lock.acquire()
+        try:
+            link = self._map.pop(key, None)
+            if link is None:
+                return default
+            link[PREV][NEXT] = link[NEXT]
+            link[NEXT][PREV] = link[PREV]
+            return link[VALUE]
+        finally:
+            self._lock.release()
+
+    def _pop_oldest(self):
+        root = self._root
+        oldest = root[NEXT]
+        if oldest is root:
+            raise KeyError("popitem(): cache is empty")
+        root[NEXT] = oldest[NEXT]
+        oldest[NEXT][PREV] = root
+        del self._map[oldest[KEY]]
+        return oldest[KEY], oldest[VALUE]
+
+    def popitem(self):
+        """Removes and returns the least recently used item."""
+        self._lock.acquire()
+        try:
+            return self._pop_oldest()
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._map.clear()
+            root = self._root
+            root[:] = [root, root, None, None]
+        finally:
+            self._lock.release()
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
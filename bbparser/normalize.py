@@ -0,0 +1,90 @@
+r"""Normalization of the text extracted from feeds.
+
+Fixes UTF-8 data that was decoded as ISO-8859-1, Windows line endings and
+the CP1252 characters found in place of the C1 control characters, with
+precomputed translate tables. Text that needs none of this, which is most
+text, is detected with a single regular expression search and returned
+untouched.
+
+>>> normalize(u'plain text')
+u'plain text'
+>>> normalize(u'caff\xc3\xa8\r\n')
+u'caff\xe8\n'
+>>> normalize(u'\x93quoted\x94')
+u'\u201cquoted\u201d'
+>>> normalize(u'caff\xe8 \u2013 ok')
+u'caff\xe8 \u2013 ok'
+>>>
+"""
+
+import re
+
+
+# straight from feedparser
+CP1252 = {
+    unichr(128): unichr(8364), # euro sign
+    unichr(130): unichr(8218), # single low-9 quotation mark
+    unichr(131): unichr( 402), # latin small letter f with hook
+    unichr(132): unichr(8222), # double low-9 quotation mark
+    unichr(133): unichr(8230), # horizontal ellipsis
+    unichr(134): unichr(8224), # dagger
+    unichr(135): unichr(8225), # double dagger
+    unichr(136): unichr( 710), # modifier letter circumflex accent
+    unichr(137): unichr(8240), # per mille sign
+    unichr(138): unichr( 352), # latin capital letter s with caron
+    unichr(139): unichr(8249), # single left-pointing angle quotation mark
+    unichr(140): unichr( 338), # latin capital ligature oe
+    unichr(142): unichr( 381), # latin capital letter z with caron
+    unichr(145): unichr(8216), # left single quotation mark
+    unichr(146): unichr(8217), # right single quotation mark
+    unichr(147): unichr(8220), # left double quotation mark
+    unichr(148): unichr(8221), # right double quotation mark
+    unichr(149): unichr(8226), # bullet
+    unichr(150): unichr(8211), # en dash
+    unichr(151): unichr(8212), # em dash
+    unichr(152): unichr( 732), # small tilde
+    unichr(153): unichr(8482), # trade mark sign
+    unichr(154): unichr( 353), # latin small letter s with caron
+    unichr(155): unichr(8250), # single right-pointing angle quotation mark
+    unichr(156): unichr( 339), # latin small ligature oe
+    unichr(158): unichr( 382), # latin small letter z with caron
+    unichr(159): unichr( 376), # latin capital letter y with diaeresis
+}
+
+CP1252_TABLE = dict((ord(k), v) for k, v in CP1252.items())
+
+# anything that might need fixing: line endings, C1 characters, UTF-8 lead bytes
+_SPECIAL_RE = re.compile(u'[\r\x80-\x9f\xc2-\xf4]')
+# a UTF-8 lead byte followed by a continuation byte
+_MOJIBAKE_RE = re.compile(u'[\xc2-\xf4][\x80-\xbf]')
+_NON_LATIN1_RE = re.compile(u'[^\x00-\xff]')
+_C1_RE = re.compile(u'[\x80-\x9f]')
+
+
+def _normalize(s):
+    # address common error where people take data that is already
+    # utf-8, presume that it is iso-8859-1, and re-encode it.
+    if _MOJIBAKE_RE.search(s) and not _NON_LATIN1_RE.search(s):
+        try:
+            s = s.encode('iso-8859-1').decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+    if u'\r' in s:
+        s = s.replace(u'\r\n', u'\n')
+    if _C1_RE.search(s):
+        s = s.translate(CP1252_TABLE)
+    return s
+
+def normalize(s):
+    """Returns s normalized, or s itself if it needs no changes."""
+    if not s or not _SPECIAL_RE.search(s):
+        return s
+    return _normalize(s)
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
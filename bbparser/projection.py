@@ -0,0 +1,167 @@
+"""Field projection, to parse only the fields the caller needs.
+
+A Projection lists the tags read by the requested fields of feeds and
+entries. While the tree is being built, direct children of the feed and of
+its entries that no requested field reads are discarded together with their
+text and children, so that a metadata only parse does not pay for the
+content of the feed. The feed and its entries are found by their position
+from the root, so that elements with the same names inside content are not
+mistaken for them.
+
+>>> p = Projection(('id', 'title'))
+>>> p.drops('{http://purl.org/rss/1.0/modules/content/}encoded', ('rss', 'channel', 'item'))
+True
+>>> p.drops('title', ('feed', 'entry')), p.drops('item', ('rss', 'channel')), p.drops('span', ('rss', 'channel', 'item', 'p'))
+(False, False, False)
+>>> p.drops('description', ('rss', 'channel', 'item', 'description', 'item'))
+False
+>>> b = p.builder()
+>>> e = b.start('rss', {}); e = b.start('channel', {}); e = b.start('item', {})
+>>> e = b.start('description', {}); b.data(u'long')
+>>> e = b.start('p', {}); e = b.end('p'); e = b.end('description')
+>>> e = b.start('title', {}); b.data(u'short'); e = b.end('title')
+>>> [el.tag for el in b.end('item')]
+['title']
+>>>
+"""
+
+try:
+    from xml.etree import cElementTree as et
+except ImportError:
+    from xml.etree import ElementTree as et
+
+
+# local names of the elements read by each field, including the ones read
+# by the fields it falls back to
+ENTRY_TAGS = dict(
+    id=('id', 'guid'),
+    title=('title',),
+    link=('link', 'guid'),
+    links=('link',),
+    summary=('description', 'summary'),
+    content=('content', 'body', 'fullitem', 'encoded', 'description', 'summary'),
+    date_published=('pubdate', 'date', 'published', 'issued', 'updated'),
+    tags=('category', 'subject'),
+    fb_origlink=('origlink',),
+    pubdate=('pubdate', 'date'),
+    published=('published',),
+    updated=('updated',),
+)
+FEED_TAGS = dict(
+    id=('id',),
+    title=('title', 'description'),
+    links=('link',),
+    description=('description',),
+    date_published=('pubdate', 'date', 'published', 'issued', 'updated'),
+    tags=('category', 'subject'),
+    pubdate=('pubdate', 'date'),
+    fb_origlink=('origlink',),
+)
+# always kept, the atom feed link is the default xml:base
+FEED_STRUCTURE = ('item', 'entry', 'link')
+# feed fields that need no elements
+FEED_ATTRIBUTES = ('version', 'xml_lang', 'entries')
+
+ENTRY_PARENTS = ('item', 'entry')
+
+
+def _local(tag):
+    return tag.rpartition('}')[2].lower()
+
+def _is_feed(path):
+    # the atom feed is the root, rss and rdf have a channel below the root
+    n = len(path)
+    return (n == 1 and path[0] == 'feed') or (n == 2 and path[1] == 'channel')
+
+
+class Projection(object):
+    """Compiled set of fields to parse.
+
+    Projections hold no parsing state and can be shared between threads and
+    reused for any number of parse calls.
+    """
+
+    def __init__(self, fields):
+        self.fields = frozenset(fields)
+        known = set(ENTRY_TAGS) | set(FEED_TAGS) | set(FEED_ATTRIBUTES)
+        unknown = self.fields - known
+        if unknown:
+            raise ValueError("Unknown fields %s" % ', '.join(sorted(unknown)))
+        feed_tags = set(FEED_STRUCTURE)
+        entry_tags = set()
+        for name in self.fields:
+            feed_tags.update(FEED_TAGS.get(name, ()))
+            entry_tags.update(ENTRY_TAGS.get(name, ()))
+        self.feed_tags = frozenset(feed_tags)
+        self.entry_tags = frozenset(entry_tags)
+
+    def __contains__(self, name):
+        return name in self.fields or name == 'entries'
+
+    def __repr__(self):
+        return "<Projection %s>" % ' '.join(sorted(self.fields))
+
+    def drops(self, tag, path):
+        """Returns True if an element with qualified tag is not read by any
+        of the fields, path is the sequence of the local names of its
+        ancestors, starting from the root."""
+        if _is_feed(path):
+            return not _local(tag) in self.feed_tags
+        if path[-1] in ENTRY_PARENTS and (len(path) == 2 or _is_feed(path[:-1])):
+            # rdf items are children of the root
+            return not _local(tag) in self.entry_tags
+        return False
+
+    def builder(self, builder_class=None):
+        """Returns a new tree builder applying the projection, that can be
+        used as the builder_class of a SgmlopTreeBuilder or the target of
+        an XMLTreeBuilder."""
+        return ProjectionBuilder(self, (builder_class or et.TreeBuilder)())
+
+
+class ProjectionBuilder(object):
+    """ElementTree builder wrapper that discards the elements dropped by a
+    projection, with all their text and children."""
+
+    def __init__(self, projection, builder):
+        self._projection = projection
+        self._builder = builder
+        self._stack = list()
+        self._skip = 0
+
+    def __getattr__(self, name):
+        # root and the other attributes of the wrapped builder
+        return getattr(self._builder, name)
+
+    def start(self, tag, attrib):
+        if self._skip:
+            self._skip += 1
+            return
+        if self._stack and self._projection.drops(tag, self._stack):
+            self._skip = 1
+            return
+        self._stack.append(_local(tag))
+        return self._builder.start(tag, attrib)
+
+    def end(self, tag):
+        if self._skip:
+            self._skip -= 1
+            return
+        if self._stack:
+            self._stack.pop()
+        return self._builder.end(tag)
+
+    def data(self, data):
+        if not self._skip:
+            self._builder.data(data)
+
+    def close(self):
+        return self._builder.close()
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
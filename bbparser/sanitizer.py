@@ -0,0 +1,205 @@
+"""Single pass HTML sanitizer.
+
+HTMLSanitizer implements the ElementTree builder interface, so that it can be
+plugged into SgmlopTreeBuilder as its builder class. Instead of building a tree
+it applies the sanitization policy as elements are opened and closed, and
+writes the resulting markup straight into an output buffer.
+
+>>> sanitize('<p><br /><dummy><em title="ok" onclick="ko">a &amp; <a href="b">c</a></em></dummy></p>', 'http://example.com/')
+u'<p><br /><em title="ok">a &amp; <a href="http://example.com/b">c</a></em></p>'
+>>> sanitize('just &lt;text&gt;', raw_text=True)
+u'just <text>'
+>>> strict = SanitizePolicy(tags=('p', 'a'), attrs=(), tag_attrs=dict(a=('href',)))
+>>> sanitize('<p align="left"><a href="/x" rel="me"><b>bold</b></a></p>', policy=strict)
+u'<p><a href="/x">bold</a></p>'
+>>>
+"""
+
+from urlparse import urljoin
+from xml.sax.saxutils import escape
+
+from sgmlop_treebuilder import pool
+
+
+XHTML_NS = 'http://www.w3.org/1999/xhtml'
+XML_BASE = '{http://www.w3.org/XML/1998/namespace}base'
+
+SANE_TAGS = """\
+a i em b strong p h1 h2 h3 h4 h5 ul ol dl li dt dd pre code q cite blockquote
+abbr s u img style table theader tbody tr th td div span hr br sup sub center
+caption col colgroup thead tfoot legend map area""".split()
+SANE_ATTRS = ('title', 'style', 'align', 'border',) # TODO: remove align and border when tests pass
+SANE_TAG_ATTRS = dict(a=('href', 'rel'), map=('name',), area=('coords', 'shape', 'href'), img=('src', 'alt', 'width', 'height', 'usemap'))
+
+ATTRIB_ENTITIES = {'"': '&quot;', '\n': '&#10;'}
+
+
+class SanitizePolicy(object):
+    """Allowed tags and attributes, compiled once into a map of the
+    attributes allowed on each allowed tag.
+
+    tags is a list of allowed tags, attrs a list of attributes allowed on all
+    of them, tag_attrs a dictionary of lists of attributes allowed on single
+    tags, and url_attrs the attributes resolved against xml:base.
+    """
+
+    def __init__(self, tags=SANE_TAGS, attrs=SANE_ATTRS, tag_attrs=SANE_TAG_ATTRS, url_attrs=('href', 'src')):
+        common = frozenset(attrs)
+        self.tags = frozenset(tags)
+        self.attrs = common
+        self.tag_attrs = dict(
+            (tag, common.union(tag_attrs.get(tag, ()))) for tag in self.tags
+        )
+        self.url_attrs = frozenset(url_attrs)
+        # policies with the same rules are interchangeable, eg in cache keys
+        self.key = (
+            self.tags, self.url_attrs,
+            frozenset(self.tag_attrs.items()),
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, SanitizePolicy) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def allowed(self, tag):
+        """Returns the attributes allowed on tag, or None if the tag is not
+        allowed."""
+        return self.tag_attrs.get(tag)
+
+DEFAULT_POLICY = SanitizePolicy()
+
+
+def _urljoin(root, rel):
+    if not root:
+        return rel
+    if not rel:
+        return root
+    if root[-1] != '/':
+        root = "%s/" % root
+    if rel[0] == '/':
+        rel = rel[1:]
+    return urljoin(root, rel)
+
+
+class HTMLSanitizer(object):
+    """Builder that writes sanitized markup for everything inside its root
+    element, which is not written itself.
+
+    Elements not allowed by the policy are dropped, but their text and
+    children are kept, and only the attributes allowed for each element are
+    written.
+    """
+
+    def __init__(self, xml_base=None, raw_text=False, ns='{%s}' % XHTML_NS, policy=DEFAULT_POLICY):
+        self._out = list()
+        self._write = self._out.append
+        self._text = list()
+        # (tag, is_sane, xml_base) for each open element
+        self._stack = list()
+        self._xml_base = xml_base
+        self._raw_text = raw_text
+        self._ns = ns
+        self._allowed = policy.tag_attrs.get
+        self._url_attrs = policy.url_attrs
+        self._pending = False
+        self._has_children = False
+        self._closed = False
+
+    def _flush(self):
+        # an open tag is left pending until we know if the element is empty
+        if self._pending:
+            self._write(u'>')
+            self._pending = False
+
+    def start(self, tag, attrib):
+        l = len(self._ns)
+        if tag[:l] == self._ns:
+            tag = tag[l:]
+        xml_base = attrib.get(XML_BASE, self._stack[-1][2] if self._stack else self._xml_base)
+        if not self._stack:
+            self._stack.append((tag, False, xml_base))
+            return
+        self._has_children = True
+        safe_attrib = self._allowed(tag)
+        sane = safe_attrib is not None
+        self._stack.append((tag, sane, xml_base))
+        if not sane:
+            return
+        self._flush()
+        attrs = list()
+        for k, v in attrib.items():
+            if k[:l] == self._ns:
+                k = k[l:]
+            if not k in safe_attrib:
+                continue
+            if k in self._url_attrs and xml_base:
+                v = _urljoin(xml_base, v)
+            attrs.append((k, v))
+        if attrs:
+            attrs.sort()
+            self._write(u'<%s %s' % (tag, u' '.join(
+                u'%s="%s"' % (k, escape(v, ATTRIB_ENTITIES)) for k, v in attrs)))
+        else:
+            self._write(u'<%s' % tag)
+        self._pending = True
+
+    def end(self, tag):
+        tag, sane, xml_base = self._stack.pop()
+        if not self._stack:
+            self._closed = True
+            return
+        if not sane:
+            return
+        if self._pending:
+            self._write(u' />')
+            self._pending = False
+        else:
+            self._write(u'</%s>' % tag)
+
+    def data(self, data):
+        if not data or self._closed:
+            return
+        if self._raw_text:
+            self._text.append(data)
+        self._flush()
+        self._write(escape(data))
+
+    def close(self):
+        if self._raw_text and not self._has_children:
+            return u''.join(self._text).strip()
+        self._flush()
+        return u''.join(self._out).strip()
+
+
+def sanitize(text, xml_base=None, raw_text=False, policy=DEFAULT_POLICY, limits=None, warnings=None):
+    """Sanitizes an HTML fragment in a single pass.
+
+    If raw_text is set and the fragment contains no elements, its text is
+    returned unescaped. If the fragment exceeds limits, LimitExceeded is
+    raised or, for partial limits, the sanitized part is returned and a
+    message added to warnings.
+    """
+    builder = lambda: HTMLSanitizer(xml_base=xml_base, raw_text=raw_text, policy=policy)
+    tb = pool.acquire(skip_ns=(XHTML_NS,), builder_class=builder)
+    tb.limits = limits
+    try:
+        tb.feed(u'<div>%s</div>' % text)
+        result = tb.close()
+        if tb.exceeded:
+            limits.exceeded(tb.exceeded, warnings if warnings is not None else list())
+        return result
+    finally:
+        pool.release(tb)
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
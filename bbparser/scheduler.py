@@ -0,0 +1,265 @@
+"""Adaptive polling schedule.
+
+PollScheduler keeps the publication times of the latest entries of each feed
+and polls each feed at an interval derived from how often it publishes,
+within min_interval and max_interval. The interval backs off when a feed has
+no new entries or cannot be fetched, and feeds due for polling are taken from
+a priority queue.
+
+>>> s = PollScheduler(min_interval=60, max_interval=86400, clock=lambda: 0)
+>>> s.add('http://example.com/rss')
+>>> s.due(now=0)
+['http://example.com/rss']
+>>> s.update('http://example.com/rss', [0, -3600, -7200], now=0)
+1800
+>>> s.due(now=1000), s.due(now=1800)
+([], ['http://example.com/rss'])
+>>> s.update('http://example.com/rss', [0, -3600, -7200], now=1800)
+3600
+>>> s.update('http://example.com/rss', error=True, now=5400)
+7200
+
+Entries dated in the future count as published at the time of the poll,
+and feeds without dates are compared by the fingerprint of their entries.
+
+>>> s.update('http://example.com/rss', [86400 * 365], now=12600)
+3300
+>>> s.update('http://example.com/undated', [], fingerprint='a', now=0)
+3600
+>>> s.update('http://example.com/undated', [], fingerprint='a', now=3600)
+7200
+>>> s.update('http://example.com/undated', [], fingerprint='b', now=10800)
+3600
+
+A feed returned by due() is due again after its interval if it is not
+updated, in case its poll failed without being recorded.
+
+>>> s = PollScheduler(min_interval=60, max_interval=86400, clock=lambda: 0)
+>>> s.add('http://example.com/lost')
+>>> s.due(now=0), s.due(now=0)
+(['http://example.com/lost'], [])
+>>> s.due(now=3600)
+['http://example.com/lost']
+>>>
+"""
+
+import time
+import heapq
+import calendar
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+
+class FeedHistory(object):
+    """Compact polling state of a feed.
+
+    timestamps are the publication times of the latest entries, newest
+    first, interval is the current polling interval and unchanged and errors
+    count the polls without new entries and the failed ones since the last
+    new entry. fingerprint identifies the entries of the last poll.
+    """
+
+    __slots__ = ('url', 'next_poll', 'interval', 'timestamps', 'unchanged', 'errors', 'fingerprint')
+
+    def __init__(self, url, next_poll, interval):
+        self.url = url
+        self.next_poll = next_poll
+        self.interval = interval
+        self.timestamps = list()
+        self.unchanged = 0
+        self.errors = 0
+        self.fingerprint = None
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        # states saved before fingerprint was added are shorter
+        self.fingerprint = None
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "<FeedHistory %s every %ss>" % (self.url, self.interval)
+
+
+def _value(obj, name):
+    # works with feed objects, records and the dictionaries from as_dict()
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+def entry_times(feed):
+    """Returns the publication times of the entries of feed, and of the
+    feed itself, as seconds since the epoch."""
+    result = list()
+    dates = [_value(e, 'date_published') for e in _value(feed, 'entries') or ()]
+    dates.append(_value(feed, 'date_published'))
+    for d in dates:
+        if d is not None:
+            result.append(calendar.timegm(d.utctimetuple()))
+    return result
+
+def entry_fingerprint(feed):
+    """Returns a digest of the ids of the entries of feed, falling back to
+    their link or title, to detect changes in feeds without dates."""
+    h = md5()
+    for e in _value(feed, 'entries') or ():
+        key = _value(e, 'id') or _value(e, 'link') or _value(e, 'title') or u''
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        h.update(key)
+        h.update('\n')
+    return h.hexdigest()
+
+
+class PollScheduler(object):
+    """Schedules feed polls from their observed publication rate.
+
+    A feed is polled about twice per average interval between its latest
+    entries, or less often if it has not published for a while.
+    default_interval is used until there are at least two entries.
+    """
+
+    def __init__(
+        self, min_interval=900, max_interval=86400, default_interval=3600,
+        history_size=20, backoff=2, clock=time.time):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+        self.history_size = history_size
+        self.backoff = backoff
+        self.clock = clock
+        self.feeds = dict()
+        self._queue = list()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_queue']
+        del state['clock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.clock = time.time
+        now = self.clock()
+        for h in self.feeds.values():
+            if h.next_poll is None:
+                # saved while being polled by an older version
+                h.next_poll = now
+        self._queue = [(h.next_poll, url) for url, h in self.feeds.items()]
+        heapq.heapify(self._queue)
+
+    def __len__(self):
+        return len(self.feeds)
+
+    def add(self, url, next_poll=None):
+        """Adds a feed, due at next_poll or immediately."""
+        if next_poll is None:
+            next_poll = self.clock()
+        history = self.feeds.get(url)
+        if history is None:
+            history = self.feeds[url] = FeedHistory(url, next_poll, self.default_interval)
+        self._schedule(history, next_poll)
+
+    def remove(self, url):
+        # its queue entry is skipped when it comes up
+        self.feeds.pop(url, None)
+
+    def _schedule(self, history, next_poll):
+        history.next_poll = next_poll
+        heapq.heappush(self._queue, (next_poll, history.url))
+
+    def next_poll(self):
+        """Returns the time the next feed is due, or None."""
+        queue = self._queue
+        while queue:
+            next_poll, url = queue[0]
+            history = self.feeds.get(url)
+            if history is not None and history.next_poll == next_poll:
+                return next_poll
+            # stale entry of a rescheduled or removed feed
+            heapq.heappop(queue)
+
+    def due(self, now=None, limit=None):
+        """Returns the feeds due at now, most overdue first. Each feed is
+        queued again at now plus its interval, so that it is polled again if
+        it is never updated, and rescheduled when it is."""
+        if now is None:
+            now = self.clock()
+        urls = list()
+        queue = self._queue
+        while queue and queue[0][0] <= now and (limit is None or len(urls) < limit):
+            next_poll, url = heapq.heappop(queue)
+            history = self.feeds.get(url)
+            if history is not None and history.next_poll == next_poll:
+                urls.append(url)
+        for url in urls:
+            # lease the feed until it is updated
+            history = self.feeds[url]
+            self._schedule(history, now + history.interval)
+        return urls
+
+    def _rate_interval(self, history, now):
+        ts = history.timestamps
+        if len(ts) < 2:
+            return self.default_interval
+        average = float(ts[0] - ts[-1]) / (len(ts) - 1)
+        return max(average, now - ts[0]) / 2
+
+    def update(self, url, timestamps=None, error=False, now=None, fingerprint=None):
+        """Records the result of polling url and schedules the next poll.
+
+        timestamps are the publication times of the entries found, see
+        entry_times(), or None if the feed was not modified. fingerprint
+        identifies the entries found, see entry_fingerprint(), so that a
+        change is noticed when the entries have no dates. Returns the new
+        polling interval.
+        """
+        if now is None:
+            now = self.clock()
+        history = self.feeds.get(url)
+        if history is None:
+            history = self.feeds[url] = FeedHistory(url, now, self.default_interval)
+        newest = history.timestamps[0] if history.timestamps else None
+        # entries dated in the future would hide the ones that follow them
+        new = [min(t, now) for t in timestamps or ()]
+        new = [t for t in new if newest is None or t > newest]
+        changed = fingerprint is not None and fingerprint != history.fingerprint
+        if fingerprint is not None:
+            history.fingerprint = fingerprint
+        if error:
+            history.errors += 1
+            interval = history.interval * self.backoff
+        elif not new and not changed:
+            history.unchanged += 1
+            interval = history.interval * self.backoff
+        else:
+            history.unchanged = history.errors = 0
+            if new:
+                ts = sorted(set(history.timestamps + new), reverse=True)
+                history.timestamps = ts[:self.history_size]
+            interval = self._rate_interval(history, now)
+        interval = int(min(self.max_interval, max(self.min_interval, interval)))
+        history.interval = interval
+        self._schedule(history, now + interval)
+        return interval
+
+    def record(self, result, now=None):
+        """Updates the schedule from a PollResult of the aio module."""
+        if result.error is not None:
+            return self.update(result.url, error=True, now=now)
+        if result.status == 304 or result.data is None:
+            return self.update(result.url, now=now)
+        return self.update(result.url, entry_times(result.data), now=now, fingerprint=entry_fingerprint(result.data))
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
@@ -14,8 +14,8 @@ __copyright__ = "Copyright (c) 1999-2004 by Fredrik Lundh. Copyright (c) 2007 by
 __version__ = "$LastChangedRevision: 1302 $"[22:-2]
 __date__ = "$LastChangedDate: 2007-02-18 13:24:10 +0100 (Sun, 18 Feb 2007) $"[18:-2]
 
-import atexit
 import htmlentitydefs
+import threading
 
 try:
     from xml.etree import cElementTree as et
@@ -25,9 +25,11 @@ from xml.etree import ElementTree as et
 
 import sgmlop
 
-
 DEBUG = False
 
+# elements nested deeper are dropped when there are no limits
+MAX_DEPTH = 300
+
 
 def log(*args):
     if DEBUG:
@@ -42,6 +44,42 @@ for k, v in htmlentitydefs.entitydefs.items():
 entitydefs['apos'] = u"'"
 entitydefs['nbsp'] = u' '
 
+
+def _charref_utf8(ref):
+    """Returns the UTF-8 encoded text for a character reference, or the
+    reference itself if it is not valid."""
+    if not ref:
+        return "&#"
+    if ref[0] == 'x':
+        base = 16
+        ref = "0%s" % ref
+    else:
+        base = 10
+    try:
+        ref = int(ref, base)
+    except (ValueError, OverflowError):
+        return ref
+    try:
+        return unichr(ref).encode('utf-8')
+    except (ValueError, OverflowError):
+        return "&#%s;" % ref
+
+def entities_utf8(defs):
+    """Returns a map of entity names to their UTF-8 encoded text, resolving
+    the character references used for the entities not in ISO-8859-1."""
+    entities = dict()
+    for k, v in defs.items():
+        if v[:2] == '&#':
+            entities[k] = _charref_utf8(str(v[2:-1]))
+        elif isinstance(v, unicode):
+            entities[k] = v.encode('utf-8')
+        else:
+            entities[k] = v
+    return entities
+
+# UTF-8 text of the character references seen, shared by all builders
+_charrefs = dict()
+
 short_tags = "area base basefont br col frame hr img input isindex link meta param".split()
 
 # shamelessly copied from libxml2's HTMLparser.c
@@ -103,22 +141,111 @@ html_startclose = dict(
     ),
 )
 
+class EndTagTreeBuilder(object):
+    """ElementTree builder wrapper that calls back on selected end tags.
+
+    The callback receives the element that has just been closed and its
+    parent, so that the caller can consume the subtree and detach it from the
+    tree while the document is still being parsed.
+
+    >>> closed = list()
+    >>> b = EndTagTreeBuilder(('item',), lambda e, p: closed.append((e.tag, p.tag)))
+    >>> e = b.start('channel', {}); e = b.start('item', {}); e = b.end('item')
+    >>> closed
+    [('item', 'channel')]
+    >>>
+    """
+
+    def __init__(self, tags, callback, builder_class=None):
+        self._builder = (builder_class or et.TreeBuilder)()
+        self._tags = tags
+        self._callback = callback
+        self._stack = list()
+        self.root = None
+        self.data = self._builder.data
+
+    def start(self, tag, attrib):
+        elem = self._builder.start(tag, attrib)
+        if self.root is None:
+            self.root = elem
+        self._stack.append(elem)
+        return elem
+
+    def end(self, tag):
+        elem = self._builder.end(tag)
+        self._stack.pop()
+        if self._stack and elem.tag in self._tags:
+            self._callback(elem, self._stack[-1])
+        return elem
+
+    def close(self):
+        return self._builder.close()
+
+
 class SgmlopTreeBuilder(object):
     """ElementTree builder for SGML source data, based on the SGMLOP parser.
     
-    You need a new builder for each new document you need to parse. This is to
-    make SgmlopTreeBuilder behave like the standard ElementTree TreeBuilder.
-    Modifying it so that it can be reused is trivial.
+    Like the standard ElementTree TreeBuilder, a builder can only parse a
+    single document, unless it is reset() after use. Use the builder pool to
+    reuse builders across documents.
     
     
     >>> p = SgmlopTreeBuilder()
     >>> p.feed('<div>Torna anche quest&#39;anno l&#39;appuntamento con il Premio Via Po, riconoscimento letterario cittadino organizzato dall&#39;Associazione Culturale per Torino in collaborazione con l&rsquo;Associazione Amici dell&rsquo;Universit&agrave; degli Studi di Torino e il contributo di Regione Piemonte e Fondazione Ferrero. Il Premio,&nbsp;intitolato quest&#39;anno...</div>')
     >>> tree = p.close()
+    >>> p.reset()
+    >>> p.feed('<div>again</div>')
+    >>> p.close().text
+    u'again'
+    
+    With limits set, building stops at the first one exceeded, text over
+    max_text is cut and the reason is left in exceeded.
+    
+    >>> from limits import Limits
+    >>> doc = '<div><p a="1" b="2">short</p><p><b>%s</b></p><p>after</p></div>' % ('x' * 100)
+    >>> for limits in (Limits(max_text=10), Limits(max_elements=3), Limits(max_attributes=1)):
+    ...     p = SgmlopTreeBuilder()
+    ...     p.limits = limits
+    ...     p.feed(doc)
+    ...     print et.tostring(p.close()), p.exceeded
+    <div><p a="1" b="2">short</p><p><b>xxxxxxxxxx</b></p></div> text size 100 exceeds the limit of 10
+    <div><p a="1" b="2">short</p><p /></div> element count exceeds the limit of 3
+    <div /> attributes on tag 'p' exceed the limit of 1
+    
+    Text outside the elements, like the one discarded before a late XML
+    declaration, does not count.
+    
+    >>> p = SgmlopTreeBuilder()
+    >>> p.limits = Limits(max_text=10)
+    >>> p.feed('%s<?xml version="1.0"?><div>short</div>' % ('x' * 50))
+    >>> et.tostring(p.close()), p.exceeded
+    ('<div>short</div>', None)
+    
+    Nothing is returned if a limit is exceeded by the first element.
+    
+    >>> p = SgmlopTreeBuilder()
+    >>> p.limits = Limits(max_elements=0)
+    >>> p.feed(doc)
+    >>> p.close(), p.exceeded
+    (None, 'element count exceeds the limit of 0')
     >>>
     """
     
     entitydefs = entitydefs
+    # entitydefs resolved to UTF-8, subclasses changing entitydefs should
+    # set it to entities_utf8(entitydefs)
+    entities = entities_utf8(entitydefs)
     short_tags = dict(zip(short_tags, [None]*len(short_tags)))
+    # receives an event for each recovery action, see the tracing module
+    tracer = None
+    # stop building when an entry past this many starts, the
+    # caller can restrict entry_tags to the entries of a known format
+    max_entries = None
+    entry_tags = ('item', 'entry')
+    truncated = False
+    # resource limits, the caller checks exceeded after close()
+    limits = None
+    exceeded = None
     
     def __init__(
         self, check_prolog=True, handle_special=False, decode=True,
@@ -136,16 +263,44 @@ class SgmlopTreeBuilder(object):
         self._ns = list()
         self._protect_recursion = list()
         self._autoclosed = list()
+        # raw UTF-8 text for the current node, decoded once when flushed
+        self._data = list()
         self._names = dict(xml='http://www.w3.org/XML/1998/namespace')
         self._builder_class = builder_class or et.TreeBuilder
-        self._builder = self._builder_class()
-        parser = parser_class or sgmlop.XMLParser
+        self._parser_class = parser_class or sgmlop.XMLParser
         self._skip_ns = skip_ns
-        self._parser = parser()
+        self._registered = False
+        self.reset()
+    
+    def reset(self, builder_class=None):
+        """Returns the builder to a clean state, ready for a new document."""
+        self.unregister()
+        if builder_class is not None:
+            self._builder_class = builder_class
+        if self.check_prolog:
+            self._prolog_found = False
+        del self.warnings[:]
+        del self._ns[:]
+        del self._protect_recursion[:]
+        del self._autoclosed[:]
+        del self._data[:]
+        self._data_size = 0
+        self._names.clear()
+        self._names['xml'] = 'http://www.w3.org/XML/1998/namespace'
+        self._builder = self._builder_class()
+        self._parser = self._parser_class()
         self._parser.register(self)
         self._registered = True
         self.closed = False
-        atexit.register(self.unregister)
+        self.tracer = None
+        self.max_entries = None
+        self.entry_tags = ('item', 'entry')
+        self.truncated = False
+        self._entries = 0
+        self.limits = None
+        self.exceeded = None
+        self._elements = 0
+        self._started = False
     
     def feed(self, data):
         """Feeds data to the parser."""
@@ -164,8 +319,13 @@ class SgmlopTreeBuilder(object):
             self._builder = None
     
     def close(self):
-        """Finishes feeding data to the parser."""
+        """Finishes feeding data to the parser. Returns None if a limit was
+        exceeded before the first element."""
         self._parser.close()
+        self._flush()
+        if self.exceeded is not None and not self._started:
+            self.unregister()
+            return None
         for tag, ns in reversed(self._ns):
             if ns:
                 self._ns_close(ns)
@@ -174,13 +334,29 @@ class SgmlopTreeBuilder(object):
         self.unregister()
         return tree
     
+    def _stop(self):
+        # ignore the rest of the document, close() ends the elements that
+        # are still open
+        self.closed = True
+        self._parser.register(None)
+    
+    def _exceeded(self, message):
+        if self.tracer is not None:
+            self.tracer.event('limit')
+        if self.exceeded is None:
+            self.exceeded = message
+        self._stop()
+    
     def _handle_proc(self, target, content):
         if self._prolog_found:
             return
         if target == 'xml':
             self._prolog_found = True
             # discard everything up to this point
-            self._ns = list()
+            del self._ns[:]
+            del self._data[:]
+            self._data_size = 0
+            self._started = False
             self._builder = self._builder_class()
             
     
@@ -192,6 +368,7 @@ class SgmlopTreeBuilder(object):
             return
         if content[:6] == 'ATTLIST':
             return
+        self._flush()
         self._builder.data("<!%s" % content)
 
     def resolve_entityref(self, ref):
@@ -205,57 +382,45 @@ class SgmlopTreeBuilder(object):
             return e.encode('utf8')
         return e
         
+    # character and entity references are added to the text buffer of the
+    # current node as UTF-8, so that a run of text with references in it
+    # reaches the tree builder as a single string
+    
     def handle_charref(self, ref):
         if self.closed:
-            log("*** closed ***")
             return
-        log("CHARREF", ref)
-        if not ref:
-            self._builder.data("&#")
-            return
-        if ref[0] == 'x':
-            base = 16
-            ref = "0%s" % ref
-        else:
-            base = 10
-        try:
-            ref = int(ref, base)
-        #    if ref in (38, 60, 62):
-        #        raise ValueError
-        except (ValueError, OverflowError):
-            self._builder.data("&#%s;" % ref if not isinstance(ref, str) else ref.decode('utf-8', 'ignore'))
-        else:
-            try:
-                self._builder.data(unichr(ref))
-            except ValueError:
-                self._builder.data("&#%s;" % ref)
+        data = _charrefs.get(ref)
+        if data is None:
+            if len(_charrefs) > 4096:
+                _charrefs.clear()
+            data = _charrefs[ref] = _charref_utf8(ref)
+        self._data.append(data)
+        if self.limits is not None and self.limits.max_text is not None:
+            self._check_text(len(data))
             
     def handle_entityref(self, ref):
-        #if ref in ('amp', 'gt','lt'):
-        #   self._builder.data('&%s;' % ref)
-        #   return
         if self.closed:
-            log("*** closed ***")
             return
-        log("REF", ref)
-        entity = self.entitydefs.get(ref, "&%s;" % ref)
-        if entity[:2] == '&#':
-            entity = self.handle_charref(entity[2:-1])
-        else:
-            if isinstance(entity, str):
-                entity = entity.decode('utf-8', 'ignore')
-            self._builder.data(entity)
+        data = self.entities.get(ref)
+        if data is None:
+            data = "&%s;" % ref
+        self._data.append(data)
+        if self.limits is not None and self.limits.max_text is not None:
+            self._check_text(len(data))
     
     def _handle_charref(self, ref):
         if self.closed:
-            log("*** closed ***")
             return
-        log("_CHARREF", ref)
-        self._builder.data("&#%s;" % ref)
+        self._data.append("&#%s;" % ref)
+        if self.limits is not None and self.limits.max_text is not None:
+            self._check_text(len(ref) + 3)
         
     def _handle_entityref(self, ref):
-        log("_REF", ref)
-        self._builder.data("&%s;" % ref)
+        if self.closed:
+            return
+        self._data.append("&%s;" % ref)
+        if self.limits is not None and self.limits.max_text is not None:
+            self._check_text(len(ref) + 2)
         
     def handle_comment(self, text):
         return
@@ -266,6 +431,23 @@ class SgmlopTreeBuilder(object):
             log("*** closed ***")
             return
         log("-- open", tag, attrib)
+        self._flush()
+        limits = self.limits
+        if limits is not None:
+            if limits.max_elements is not None:
+                self._elements += 1
+                if self._elements > limits.max_elements:
+                    self._exceeded("element count exceeds the limit of %d" % limits.max_elements)
+                    return
+            if limits.max_attributes is not None and len(attrib) > limits.max_attributes:
+                self._exceeded("attributes on tag '%s' exceed the limit of %d" % (tag, limits.max_attributes))
+                return
+            if self.closed:
+                # the text just flushed was too large
+                return
+            max_depth = limits.max_depth
+        else:
+            max_depth = MAX_DEPTH
         # look for namespaces in attributes
         ns = list()
         ns_attrib = []
@@ -325,11 +507,13 @@ class SgmlopTreeBuilder(object):
             _tag, _ns = self._ns[-1]
             if _tag in autoclose:
                 log("--- got", tag, "autoclosing ", _tag)
+                if self.tracer is not None:
+                    self.tracer.event('autoclose')
                 self._autoclosed.append(_tag)
                 if _ns:
                     self._ns_close(_ns)
                 self._builder.end(_tag)
-                self._ns = self._ns[:-1]
+                del self._ns[-1]
             #_i = None
             #for i, t in enumerate(self._ns):
             #    _tag, _ns = t
@@ -347,15 +531,27 @@ class SgmlopTreeBuilder(object):
             #        self._builder.end(_tag)
             #    self._ns = self._ns[:_i]
             #    log("--- [self._ns]", self._ns)
+        if self.max_entries is not None and self._starts_entry(tag):
+            if self._entries >= self.max_entries:
+                log("***** truncated after", self._entries, "entries *****")
+                self.truncated = True
+                self._stop()
+                return
+            self._entries += 1
         if tag not in ('br', 'hr', 'img'):
-            if len(self._ns) > 300:
+            if max_depth is not None and len(self._ns) > max_depth:
+                if self.tracer is not None:
+                    self.tracer.event('recursion')
                 self._protect_recursion.append((tag, ns))
+                if limits is not None and len(self._protect_recursion) > max_depth:
+                    self._exceeded("nesting depth exceeds the limit of %d" % (2 * max_depth))
                 return
             else:
                 self._ns.append((tag, ns))
         log("--- [self._ns]", self._ns)
         # now build the element
         #log('<--- open', tag, len(self._ns), self._ns)
+        self._started = True
         try:
             self._builder.start(tag, attrib)
         except SyntaxError, e:
@@ -367,6 +563,14 @@ class SgmlopTreeBuilder(object):
             # shortcircuit
             self._builder.end(tag)
 
+    def _starts_entry(self, tag):
+        # entries are children of the atom feed and the rdf root, or of the
+        # rss channel, elements with the same name in content are not
+        if not tag.rpartition('}')[2] in self.entry_tags:
+            return False
+        depth = len(self._ns)
+        return depth == 1 or (depth == 2 and self._ns[1][0].rpartition('}')[2] == 'channel')
+
     def finish_endtag(self, tag):
         """
         >>> doc = "<root><a><b><c>umph</a></c></root><other></other>"
@@ -384,6 +588,7 @@ class SgmlopTreeBuilder(object):
             log("*** closed ***")
             return
         log("-- close", tag)
+        self._flush()
         # check the tag namespace
         tag = tag.lower()
         pos = tag.find(':')
@@ -419,6 +624,8 @@ class SgmlopTreeBuilder(object):
                 # stray tag close
                 if tag in self._autoclosed:
                     log("--- found in autoclosed")
+                    if self.tracer is not None:
+                        self.tracer.event('stray_close')
                     i = max(i for i, t in enumerate(self._autoclosed) if t == tag)
                     del(self._autoclosed[i])
                     self._ns.append((open_tag, ns))
@@ -444,11 +651,15 @@ class SgmlopTreeBuilder(object):
                         i = max(i for i, t in enumerate(self._ns[bg_start:]) if t[0] == tag)
                     except ValueError:
                         log("--- no backtracking possible, appending", open_tag, ns)
+                        if self.tracer is not None:
+                            self.tracer.event('stray_close')
                         self._ns.append((open_tag, ns))
                         #if len(self._ns) == 1:
                         return
                     else:
                         log("---- closing expected open tag", open_tag)
+                        if self.tracer is not None:
+                            self.tracer.event('backtrack')
                         if ns:
                             self._ns_close(ns)
                         self._autoclosed.append(open_tag)
@@ -463,7 +674,7 @@ class SgmlopTreeBuilder(object):
                                 self._builder.end(open_tag)
                             except IndexError:
                                 pass
-                        self._ns = self._ns[:i+bg_start]
+                        del self._ns[i+bg_start:]
         #if not self.strict:
         #    # check that the top-level element has been closed
         #    if not self._ns:
@@ -492,9 +703,80 @@ class SgmlopTreeBuilder(object):
         
     def handle_data(self, data):
         #log("data:", data)
-        self._builder.data(data.decode('utf-8'))
+        self._data.append(data)
+        if self.limits is not None and self.limits.max_text is not None:
+            self._check_text(len(data))
+    
+    def _check_text(self, size):
+        # stop as soon as the text of the node is too large, instead of
+        # buffering all of it first; text outside the elements is discarded
+        # by the builder and not counted
+        if not self._ns:
+            return
+        self._data_size += size
+        if self._data_size > self.limits.max_text:
+            self._flush()
+    
+    def _flush(self):
+        if self._data:
+            if len(self._data) == 1:
+                data = self._data[0]
+            else:
+                data = ''.join(self._data)
+            del self._data[:]
+            self._data_size = 0
+            limits = self.limits
+            if limits is not None and limits.max_text is not None and len(data) > limits.max_text and self._ns:
+                max_text = limits.max_text
+                self._exceeded("text size %d exceeds the limit of %d" % (len(data), max_text))
+                # don't cut a character in half
+                self._builder.data(data[:max_text].decode('utf-8', 'ignore'))
+                return
+            self._builder.data(data.decode('utf-8'))
+
+
+
+class TreeBuilderPool(threading.local):
+    """Thread local pool of SgmlopTreeBuilder instances.
+
+    Builders are grouped by their constructor arguments, except builder_class
+    which is set each time a builder is acquired.
+
+    >>> pool = TreeBuilderPool()
+    >>> b = pool.acquire(skip_ns=('http://www.w3.org/1999/xhtml',))
+    >>> b.feed('<div>a</div>')
+    >>> tree = b.close()
+    >>> pool.release(b)
+    >>> pool.acquire(skip_ns=('http://www.w3.org/1999/xhtml',)) is b
+    True
+    >>>
+    """
+
+    def __init__(self, size=4):
+        self.size = size
+        self._free = dict()
+
+    def acquire(self, builder_class=None, **kw):
+        key = tuple(sorted(kw.items()))
+        free = self._free.get(key)
+        if free:
+            builder = free.pop()
+            builder.reset(builder_class or et.TreeBuilder)
+            return builder
+        builder = SgmlopTreeBuilder(builder_class=builder_class, **kw)
+        builder._pool_key = key
+        return builder
+
+    def release(self, builder):
+        # drop the references to the parser and the tree being built
+        builder.unregister()
+        free = self._free.setdefault(builder._pool_key, list())
+        if len(free) < self.size:
+            free.append(builder)
+
+pool = TreeBuilderPool()
+
 
-        
 def _test():
     import doctest
     doctest.testmod()
@@ -0,0 +1,126 @@
+"""Detection of the root element from the first bytes of a document.
+
+root_tag() skips the XML declaration, processing instructions, comments and
+the doctype, reads the first start tag and resolves its namespace from the
+declarations on the tag itself, the same way the sgmlop tree builder names
+the root of the tree. Documents that are not feeds, like HTML error pages,
+can then be rejected without building a tree.
+
+The tree builder discards everything before a late XML declaration, so
+markup followed by one, like a PHP warning printed before the feed, gives
+None and is left to the parser.
+
+>>> root_tag('<?xml version="1.0"?>\\n<!-- x --><rss version="2.0"><channel>')
+'rss'
+>>> root_tag('<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" xmlns="http://purl.org/rss/1.0/">')
+'{http://www.w3.org/1999/02/22-rdf-syntax-ns#}rdf'
+>>> root_tag('<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN" "x.dtd">\\n<html xmlns="http://www.w3.org/1999/xhtml">')
+'{http://www.w3.org/1999/xhtml}html'
+>>> root_tag('<b>Warning</b>: Cannot modify header information<br />\\n<?xml version="1.0"?><rss version="2.0">')
+>>> root_tag('{"items": []}'), root_tag('<feed xmlns="http://www.w3.org/2005/Atom"')
+(None, None)
+>>>
+"""
+
+import re
+import codecs
+
+
+# how far into the document the root element is looked for
+SNIFF_SIZE = 4096
+
+XML_DECL_RE = re.compile(r'<\?xml[\s?]')
+NAME_RE = re.compile(r'([A-Za-z_][\w.:-]*)(?=[\s/>])')
+ATTR_RE = re.compile(r'\s*([^\s=/>]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+TAG_END_RE = re.compile(r'\s*/?>')
+
+XML_NS = 'http://www.w3.org/XML/1998/namespace'
+
+
+def _skip(source, pos, end, marker):
+    pos = source.find(marker, pos, end)
+    if pos < 0:
+        return None
+    return pos + len(marker)
+
+def root_tag(source, size=SNIFF_SIZE):
+    """Returns the qualified tag of the root element of UTF-8 or ASCII
+    encoded source, with the local name lowercased, or None if it cannot be
+    found in the first size bytes, text comes before it or an XML
+    declaration follows it."""
+    end = min(len(source), size)
+    pos = 0
+    if source.startswith(codecs.BOM_UTF8):
+        pos = len(codecs.BOM_UTF8)
+    while True:
+        last = pos
+        pos = source.find('<', pos, end)
+        if pos < 0 or source[last:pos].strip():
+            return None
+        if source.startswith('<?', pos):
+            pos = _skip(source, pos, end, '?>')
+        elif source.startswith('<!--', pos):
+            pos = _skip(source, pos, end, '-->')
+        elif source[pos:pos+9].upper() == '<!DOCTYPE':
+            close = source.find('>', pos, end)
+            subset = source.find('[', pos, end)
+            if subset >= 0 and (close < 0 or subset < close):
+                # the internal subset can contain tags
+                pos = _skip(source, subset, end, ']')
+                if pos is not None:
+                    pos = _skip(source, pos, end, '>')
+            else:
+                pos = _skip(source, pos, end, '>')
+        else:
+            if XML_DECL_RE.search(source, pos, end) is not None:
+                # the builder restarts at the declaration
+                return None
+            return _start_tag(source, pos + 1, end)
+        if pos is None:
+            return None
+
+def _start_tag(source, pos, end):
+    m = NAME_RE.match(source, pos, end)
+    if m is None:
+        return None
+    # lowercase like the tree builder
+    tag = m.group(1).lower()
+    pos = m.end()
+    names = dict(xml=XML_NS)
+    while True:
+        m = TAG_END_RE.match(source, pos, end)
+        if m is not None:
+            break
+        m = ATTR_RE.match(source, pos, end)
+        if m is None:
+            return None
+        name = m.group(1).lower()
+        value = m.group(2)
+        if value is None:
+            value = m.group(3)
+        if name == 'xmlns' or name.startswith('xmlns:'):
+            if '&' in value:
+                # references are only resolved by the parser
+                return None
+            if name == 'xmlns':
+                names[None] = value
+            else:
+                names[name[6:]] = value
+        pos = m.end()
+    prefix = None
+    colon = tag.find(':')
+    if colon > 0:
+        prefix = tag[:colon]
+        tag = tag[colon+1:]
+    ns = names.get(prefix)
+    if ns:
+        return "{%s}%s" % (ns, tag)
+    return tag
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
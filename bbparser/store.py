@@ -0,0 +1,363 @@
+"""Persistent store of parsed feeds.
+
+Feed records are serialized with a compact, versioned binary encoding, and
+appended to a store file keyed by feed URL or content hash. Readers map the
+file in memory and only decode the records they are asked for, so that a
+restarted worker, or another process, can load parse results without
+parsing the feeds again.
+
+>>> import datetime
+>>> from iso8601 import UTC
+>>> from bbparser import EntryRecord, FeedRecord
+>>> entry = EntryRecord(title=u'caff\\xe8', date_published=datetime.datetime(2009, 1, 2, 3, 4, 5, tzinfo=UTC), tags=[dict(term=u'x', scheme=None, label=None)])
+>>> record = loads(dumps(FeedRecord(title=u'feed', entries=[entry], warnings=[])))
+>>> record.title, record.entries[0].title, record.entries[0].date_published
+(u'feed', u'caff\\xe8', datetime.datetime(2009, 1, 2, 3, 4, 5, tzinfo=<UTC>))
+>>> record.entries[0].tags
+[{'term': u'x', 'scheme': None, 'label': None}]
+>>>
+"""
+
+import os
+import mmap
+import zlib
+import struct
+import datetime
+import threading
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from bbparser import Feed, FeedRecord, EntryRecord, ParserError
+from iso8601 import UTC
+
+
+# version of the encoding, stored in front of each record
+VERSION = 2
+# record fields for each version of the encoding, in encoding order
+LAYOUTS = {
+    1: (
+        ('title', 'link', 'links', 'id', 'description', 'date_published',
+         'tags', 'version', 'xml_lang', 'entries', 'warnings', 'truncated'),
+        ('id', 'title', 'link', 'links', 'summary', 'content',
+         'date_published', 'tags', 'fb_origlink'),
+    ),
+    2: (
+        ('title', 'link', 'links', 'id', 'description', 'date_published',
+         'tags', 'version', 'xml_lang', 'entries', 'warnings', 'truncated',
+         'pubdate', 'fb_origlink'),
+        ('id', 'title', 'link', 'links', 'summary', 'content',
+         'date_published', 'tags', 'fb_origlink', 'pubdate', 'published',
+         'updated'),
+    ),
+}
+
+FILE_MAGIC = 'BBPSTORE\x01'
+ITEM_HEADER = struct.Struct('<III')
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=UTC)
+
+
+class StoreError(ParserError):
+    pass
+
+
+def _varint(n, write):
+    while n > 0x7f:
+        write(chr(n & 0x7f | 0x80))
+        n >>= 7
+    write(chr(n))
+
+def _zigzag(n, write):
+    _varint(n << 1 if n >= 0 else (-n << 1) - 1, write)
+
+def _encode(value, write, layout, strings):
+    if value is None:
+        write('N')
+    elif value is True:
+        write('T')
+    elif value is False:
+        write('F')
+    elif isinstance(value, (int, long)):
+        write('I')
+        _zigzag(value, write)
+    elif isinstance(value, basestring):
+        # repeated strings, like dict keys and content copied from the
+        # summary, are written once and then referenced
+        key = (value.__class__, value)
+        index = strings.get(key)
+        if index is not None:
+            write('P')
+            _varint(index, write)
+            return
+        strings[key] = len(strings)
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+            write('U')
+        else:
+            write('S')
+        _varint(len(value), write)
+        write(value)
+    elif isinstance(value, datetime.datetime):
+        # naive datetimes are assumed to be in UTC
+        if value.tzinfo is not None:
+            value = value.astimezone(UTC)
+        delta = value.replace(tzinfo=UTC) - EPOCH
+        write('D')
+        _zigzag(delta.days * 86400 + delta.seconds, write)
+        _varint(delta.microseconds, write)
+    elif isinstance(value, (list, tuple)):
+        write('L')
+        _varint(len(value), write)
+        for v in value:
+            _encode(v, write, layout, strings)
+    elif isinstance(value, dict):
+        write('M')
+        _varint(len(value), write)
+        for k, v in value.items():
+            _encode(k, write, layout, strings)
+            _encode(v, write, layout, strings)
+    elif isinstance(value, (FeedRecord, EntryRecord)):
+        if isinstance(value, FeedRecord):
+            write('R')
+            fields = layout[0]
+        else:
+            write('E')
+            fields = layout[1]
+        for name in fields:
+            _encode(getattr(value, name, None), write, layout, strings)
+    else:
+        raise TypeError("cannot encode %r" % (value,))
+
+def dumps(record):
+    """Returns the binary encoding of a FeedRecord or EntryRecord, feed and
+    entry objects are materialized first."""
+    if isinstance(record, Feed):
+        record = record.materialize()
+    out = list()
+    write = out.append
+    write(chr(VERSION))
+    _encode(record, write, LAYOUTS[VERSION], dict())
+    return ''.join(out)
+
+
+def _read_varint(data, pos):
+    n = shift = 0
+    while True:
+        b = ord(data[pos])
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+def _read_zigzag(data, pos):
+    n, pos = _read_varint(data, pos)
+    return (n >> 1) ^ -(n & 1), pos
+
+def _decode(data, pos, layout, strings):
+    tag = data[pos]
+    pos += 1
+    if tag == 'N':
+        return None, pos
+    if tag == 'T':
+        return True, pos
+    if tag == 'F':
+        return False, pos
+    if tag == 'I':
+        return _read_zigzag(data, pos)
+    if tag == 'U' or tag == 'S':
+        n, pos = _read_varint(data, pos)
+        value = data[pos:pos+n]
+        if tag == 'U':
+            value = value.decode('utf-8')
+        strings.append(value)
+        return value, pos + n
+    if tag == 'P':
+        n, pos = _read_varint(data, pos)
+        return strings[n], pos
+    if tag == 'D':
+        seconds, pos = _read_zigzag(data, pos)
+        microseconds, pos = _read_varint(data, pos)
+        return EPOCH + datetime.timedelta(seconds=seconds, microseconds=microseconds), pos
+    if tag == 'L':
+        n, pos = _read_varint(data, pos)
+        value = list()
+        for i in xrange(n):
+            v, pos = _decode(data, pos, layout, strings)
+            value.append(v)
+        return value, pos
+    if tag == 'M':
+        n, pos = _read_varint(data, pos)
+        value = dict()
+        for i in xrange(n):
+            k, pos = _decode(data, pos, layout, strings)
+            value[k], pos = _decode(data, pos, layout, strings)
+        return value, pos
+    if tag == 'R' or tag == 'E':
+        if tag == 'R':
+            cls, fields = FeedRecord, layout[0]
+        else:
+            cls, fields = EntryRecord, layout[1]
+        # fields added after the version of the record are None
+        values = dict.fromkeys(cls.__slots__)
+        for name in fields:
+            values[name], pos = _decode(data, pos, layout, strings)
+        return cls(**values), pos
+    raise StoreError("invalid tag %r at %d" % (tag, pos - 1))
+
+def loads(data):
+    """Decodes a record encoded by dumps(), with any known version."""
+    layout = LAYOUTS.get(ord(data[0]))
+    if layout is None:
+        raise StoreError("unknown encoding version %d" % ord(data[0]))
+    try:
+        return _decode(data, 1, layout, list())[0]
+    except IndexError:
+        raise StoreError("truncated record")
+
+def content_key(source):
+    """Returns a key for the raw data of a feed, for stores keyed by content."""
+    if isinstance(source, unicode):
+        source = source.encode('utf-8')
+    return md5(source).hexdigest()
+
+
+class FeedStore(object):
+    """Append only file of encoded feed records, keyed by strings.
+
+    Putting a key again appends a new record which replaces the old one,
+    compact() rewrites the file with only the current records. A single
+    process should write to a store, readers call refresh() to see the
+    records appended since they opened it.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self._index = dict()
+        self._lock = threading.Lock()
+        self._map = None
+        self._end = len(FILE_MAGIC)
+        if not readonly:
+            if not os.path.exists(path) or not os.path.getsize(path):
+                f = open(path, 'wb')
+                try:
+                    f.write(FILE_MAGIC)
+                finally:
+                    f.close()
+        self._file = open(path, 'rb' if readonly else 'r+b')
+        if self._file.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            self._file.close()
+            raise StoreError("%s is not a feed store" % path)
+        self.refresh()
+        if not readonly:
+            # drop a partially written last item
+            self._file.truncate(self._end)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def keys(self):
+        return self._index.keys()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def _remap(self):
+        size = os.fstat(self._file.fileno()).st_size
+        if self._map is not None:
+            if len(self._map) == size:
+                return
+            self._map.close()
+        self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+
+    def refresh(self):
+        """Indexes the items appended since the last refresh, stopping at
+        the first incomplete or corrupted one."""
+        self._lock.acquire()
+        try:
+            self._remap()
+            data = self._map
+            pos = self._end
+            size = len(data)
+            while pos + ITEM_HEADER.size <= size:
+                key_length, length, crc = ITEM_HEADER.unpack(data[pos:pos+ITEM_HEADER.size])
+                start = pos + ITEM_HEADER.size
+                end = start + key_length + length
+                if end > size or zlib.crc32(data[start:end]) & 0xffffffff != crc:
+                    break
+                key = data[start:start+key_length].decode('utf-8')
+                self._index[key] = (start + key_length, length)
+                pos = end
+            self._end = pos
+        finally:
+            self._lock.release()
+
+    def get(self, key, default=None):
+        """Returns the record stored for key, decoded."""
+        self._lock.acquire()
+        try:
+            item = self._index.get(key)
+            if item is None:
+                return default
+            offset, length = item
+            data = self._map[offset:offset+length]
+        finally:
+            self._lock.release()
+        return loads(data)
+
+    def put(self, key, record):
+        """Appends record, a feed or a FeedRecord, as the value for key."""
+        if self.readonly:
+            raise StoreError("%s is read only" % self.path)
+        self._write(key, dumps(record))
+
+    def _write(self, key, value):
+        key = key.encode('utf-8') if isinstance(key, unicode) else key
+        item = key + value
+        self._lock.acquire()
+        try:
+            self._file.seek(self._end)
+            self._file.write(ITEM_HEADER.pack(len(key), len(value), zlib.crc32(item) & 0xffffffff))
+            self._file.write(item)
+            self._file.flush()
+            start = self._end + ITEM_HEADER.size
+            self._index[key.decode('utf-8')] = (start + len(key), len(value))
+            self._end = start + len(item)
+            self._remap()
+        finally:
+            self._lock.release()
+
+    def compact(self):
+        """Rewrites the store with only the current record for each key."""
+        if self.readonly:
+            raise StoreError("%s is read only" % self.path)
+        tmp = "%s.tmp" % self.path
+        # empty what an interrupted compaction left behind
+        open(tmp, 'wb').close()
+        new = FeedStore(tmp)
+        try:
+            for key, (offset, length) in sorted(self._index.items(), key=lambda i: i[1]):
+                new._write(key, self._map[offset:offset+length])
+        finally:
+            new.close()
+        self.close()
+        os.rename(tmp, self.path)
+        self.__init__(self.path)
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
@@ -0,0 +1,160 @@
+"""Tracing hooks for the parsing pipeline.
+
+A tracer receives start and stop events for each pipeline stage (decode,
+tree, factory) and for each lazy property computed on feeds and entries, and
+named events for the recovery actions of the tree builder (autoclose,
+backtrack, stray_close, recursion) and cache hits. Tracers can be installed globally with
+set_tracer(), or per call with parse(..., tracer=...). Traced methods run
+undecorated until a tracer is installed for the first time, so that parsing
+without a tracer does not pay for the wrappers; after that, calls without a
+tracer only cost a test for None.
+
+>>> t = StatsTracer()
+>>> t.start('decode', 10); t.stop('decode', 8); t.event('autoclose')
+>>> s = t.stats()
+>>> s['stages']['decode']['count'], s['stages']['decode']['bytes'], s['events']
+(1, 8, {'autoclose': 1})
+>>>
+"""
+
+import time
+import functools
+
+
+tracer = None
+
+# traced attributes of registered classes, as (class, name, plain, traced)
+_registry = list()
+_enabled = False
+
+
+def set_tracer(t):
+    """Installs t as the global tracer, None removes it."""
+    global tracer
+    if t is not None:
+        enable()
+    tracer = t
+
+def register(cls):
+    """Replaces the methods and properties of cls decorated with traced()
+    by their undecorated version, until enable() is called."""
+    for name, value in cls.__dict__.items():
+        if isinstance(value, property):
+            f = getattr(value.fget, '_untraced', None)
+            if f is None:
+                continue
+            plain = property(f, value.fset, value.fdel, value.__doc__)
+        else:
+            plain = getattr(value, '_untraced', None)
+            if plain is None:
+                continue
+        _registry.append((cls, name, plain, value))
+        if not _enabled:
+            setattr(cls, name, plain)
+
+def enable():
+    """Installs the traced methods and properties of the registered
+    classes, they stay installed once a tracer has been used."""
+    global _enabled
+    if _enabled:
+        return
+    for cls, name, plain, value in _registry:
+        setattr(cls, name, value)
+    _enabled = True
+
+def get_tracer():
+    return tracer
+
+
+class Tracer(object):
+    """Base tracer, which ignores all events."""
+
+    def start(self, stage, size=None):
+        pass
+
+    def stop(self, stage, size=None):
+        pass
+
+    def event(self, name):
+        pass
+
+
+class StatsTracer(Tracer):
+    """Tracer that accumulates count, time and bytes for each stage, and a
+    counter for each event."""
+
+    def __init__(self, timer=time.time):
+        self.timer = timer
+        self.stages = dict()
+        self.events = dict()
+        self._started = list()
+
+    def start(self, stage, size=None):
+        self._started.append((stage, self.timer()))
+
+    def stop(self, stage, size=None):
+        now = self.timer()
+        # pop until the matching start, in case a stage raised
+        while self._started:
+            name, started = self._started.pop()
+            if name == stage:
+                break
+        else:
+            return
+        s = self.stages.get(stage)
+        if s is None:
+            s = self.stages[stage] = dict(count=0, time=0.0, bytes=0)
+        s['count'] += 1
+        s['time'] += now - started
+        if size:
+            s['bytes'] += size
+
+    def event(self, name):
+        self.events[name] = self.events.get(name, 0) + 1
+
+    def stats(self):
+        return dict(stages=self.stages, events=self.events)
+
+
+def _size(value):
+    if isinstance(value, basestring):
+        return len(value)
+    if isinstance(value, list):
+        return sum(_size(v.get('value')) if isinstance(v, dict) else _size(v) for v in value)
+    return 0
+
+def traced(name, attr=None):
+    """Decorator for methods of objects with a tracer attribute, which
+    reports the call as a stage with the size of its result.
+    
+    attr is the name of the attribute where the method caches its result,
+    formatted with the first argument if it contains %s, so that cached
+    results are not reported.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(self, *args, **kwargs):
+            t = self.tracer
+            if t is None:
+                return f(self, *args, **kwargs)
+            if attr is not None and hasattr(self, attr % args if '%' in attr else attr):
+                return f(self, *args, **kwargs)
+            t.start(name)
+            result = None
+            try:
+                result = f(self, *args, **kwargs)
+                return result
+            finally:
+                t.stop(name, _size(result))
+        # installed instead of the wrapper by register()
+        wrapper._untraced = f
+        return wrapper
+    return decorator
+
+
+def _test():
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()